@@ -1,15 +1,21 @@
-import pandas as pd
 import streamlit as st
 import streamlit_permalink as stp
 import peptacular as pt
 from app_input import get_params
 
-from fragment_utils import style_fragment_table
+import instrumentation
+from constants import SHOW_DIAGNOSTICS
+from crosslink_utils import is_crosslinked, find_link_sites, map_chains, split_chains
+from spectrum_utils import display_spectrum
 from utils import (apply_centering_ccs, apply_expanded_sidebar,
-                   create_caption_vertical,
-                   create_caption_horizontal, display_header,
+                   display_header,
                    validate_peptide,
-                   display_results)
+                   get_fragment_table,
+                   get_crosslink_tables,
+                   display_results,
+                   display_crosslink_results,
+                   fragment_table_to_tsv,
+                   speculate_next)
 
 TABLE_DIV_ID = 'custom-table-id'
 
@@ -46,57 +52,50 @@ with top_window:
 
     validate_peptide(params.peptide_sequence)
 
+    # link sites are read before mass notation condensing, which drops the cross-link labels
+    link_sites = find_link_sites(params.peptide_sequence) if is_crosslinked(params.peptide_sequence) else None
+
     if params.use_carbamidomethyl:
-        params.peptide_sequence = pt.condense_static_mods(
-            pt.add_mods(params.peptide_sequence, {'static': '[Carbamidomethyl]@C'}), include_plus=True)
+        params.peptide_sequence = map_chains(params.peptide_sequence, lambda chain: pt.condense_static_mods(
+            pt.add_mods(chain, {'static': '[Carbamidomethyl]@C'}), include_plus=True))
 
     if params.condense_to_mass_notation:
-        params.peptide_sequence = pt.condense_to_mass_mods(params.peptide_sequence, include_plus=True,
-                                                           precision=params.precision)
-
-    annotation = pt.parse(params.peptide_sequence)
+        params.peptide_sequence = map_chains(params.peptide_sequence, lambda chain: pt.condense_to_mass_mods(
+            chain, include_plus=True, precision=params.precision))
 
     # ensure that mass can be calculated
     try:
-        _ = pt.mass(annotation, monoisotopic=True, ion_type='p', charge=0)
+        for chain in split_chains(params.peptide_sequence):
+            _ = pt.mass(chain, monoisotopic=True, ion_type='p', charge=0)
     except Exception as err:
         st.error(f'Error calculating peptide mass: {err}')
         st.stop()
 
-    annot_without_labile_mods = annotation.copy()
-    annot_without_labile_mods.pop_labile_mods()
-
     # Calculate fragment table based on inputs
-    style_df, fragments = style_fragment_table(
-        sequence=annotation.serialize(include_plus=True),
-        fragment_types=params.fragment_types,
-        charge=params.charge,
-        is_monoisotopic=params.is_monoisotopic,
-        show_borders=params.show_borders,
-        decimal_places=params.precision,
-        row_padding=params.row_padding,
-        column_padding=params.column_padding,
-        min_mass=params.min_mz if params.use_mass_bounds else None,
-        max_mass=params.max_mz if params.use_mass_bounds else None,
-        color_map=params.frag_colors,
-        caption=create_caption_horizontal(
-            params) if params.is_horizontal_caption else create_caption_vertical(params),
-    )
-
-    frag_df = pd.DataFrame([fragment.to_dict() for fragment in fragments])
-
-    frag_tab, data_tab, copy_tab = st.tabs(['Table', 'Data', 'Copy'])
+    if link_sites is not None:
+        style_dfs, frag_df = get_crosslink_tables(params, link_sites)
+    else:
+        style_df, frag_df = get_fragment_table(params)
+        style_dfs = [style_df]
+
+    frag_tab, spectrum_tab, data_tab, copy_tab = st.tabs(['Table', 'Spectrum', 'Data', 'Copy'])
 
     with frag_tab:
 
         # within container to allow for custom table id
         with st.container(key=TABLE_DIV_ID):
-            display_results(style_df, params)
+            if link_sites is not None:
+                display_crosslink_results(params, link_sites)
+            else:
+                display_results(style_df, params)
+
+    with spectrum_tab:
+        display_spectrum(params, link_sites)
 
     with data_tab:
 
         st.caption('Fragment Data')
-        frag_df['in_bounds'] = True
+        frag_df = frag_df.assign(in_bounds=True)
 
         if params.use_mass_bounds:
             frag_df.loc[frag_df['mz'] < params.min_mz, 'in_bounds'] = False
@@ -104,9 +103,10 @@ with top_window:
 
         st.dataframe(frag_df, hide_index=True)
 
+        file_prefix = '_'.join(pt.strip_mods(chain) for chain in split_chains(params.peptide_sequence))
         st.download_button(label='Download Data',
                            data=frag_df.to_csv(index=False),
-                           file_name=f'{annotation._sequence}_fragment_data.csv',
+                           file_name=f'{file_prefix}_fragment_data.csv',
                            use_container_width=True,
                            type='primary',
                            on_click='ignore',
@@ -114,7 +114,14 @@ with top_window:
 
     with copy_tab:
         st.caption('Copy Data')
-        st.data_editor(style_df, hide_index=True)
+        st.code('\n'.join(fragment_table_to_tsv(style_df, params.precision) for style_df in style_dfs),
+                language=None)
+
+    speculate_next(params, link_sites)
+
+    if SHOW_DIAGNOSTICS:
+        with st.sidebar.expander('Diagnostics'):
+            st.json(instrumentation.snapshot())
 
     st.divider()
 
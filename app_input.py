@@ -1,12 +1,15 @@
 from dataclasses import dataclass
 from typing import Literal, Optional
+import pandas as pd
 import streamlit as st
 import streamlit as st
 import streamlit_permalink as stp
 
+from mod_index import get_mod_index
+
 from constants import (DEFAULT_PEPTIDE, DEFAULT_CHARGE, DEFAULT_MASS_TYPE, DEFAULT_FRAGMENT_TYPES,
     DEFAULT_USE_MASS_BOUNDS, DEFAULT_MIN_MZ, DEFAULT_MAX_MZ, DEFAULT_PRECISION,
-    DEFAULT_ROW_PADDING, DEFAULT_COLUMN_PADDING, DEFAULT_SHOW_BORDERS,
+    DEFAULT_ROW_PADDING, DEFAULT_COLUMN_PADDING, DEFAULT_SHOW_BORDERS, DEFAULT_ROWS_PER_PAGE,
     DEFAULT_A_COLOR, DEFAULT_B_COLOR, DEFAULT_C_COLOR,
     DEFAULT_X_COLOR, DEFAULT_Y_COLOR, DEFAULT_Z_COLOR
 )
@@ -29,6 +32,7 @@ class FragmentParams:
     row_padding: int
     column_padding: int
     show_borders: bool
+    rows_per_page: int
     display_type: CAPTION_TYPES 
     a_color: str
     b_color: str
@@ -71,6 +75,19 @@ def get_params() -> FragmentParams:
                                         max_chars=2000,
                                         help=peptide_help_msg,
                                         key='peptide')
+
+    with st.expander('Modification Lookup'):
+        mod_query = st.text_input('Search Modifications',
+                                  help='Start typing a Unimod or PSI-MOD name to find its accession and mass. '
+                                       'Use the name in square brackets, e.g. PEPT[Phospho]IDE',
+                                  key='mod_search')
+        if mod_query:
+            matches = get_mod_index().search(mod_query)
+            if matches:
+                st.dataframe(pd.DataFrame(matches, columns=['Name', 'Accession', 'Monoisotopic', 'Average']),
+                             hide_index=True, use_container_width=True)
+            else:
+                st.caption(f'No modifications start with "{mod_query}"')
     charge = stp.number_input('Charge State',
                                 min_value=0,
                                 value=DEFAULT_CHARGE,
@@ -155,6 +172,14 @@ def get_params() -> FragmentParams:
                                     value=DEFAULT_SHOW_BORDERS,
                                     help='Show borders in the table',
                                     url_key='show_borders')
+
+        rows_per_page = stp.number_input('Rows Per Page',
+                                         value=DEFAULT_ROWS_PER_PAGE,
+                                         min_value=10,
+                                         max_value=1000,
+                                         step=10,
+                                         help='Number of residues to render at once. Longer tables are paginated',
+                                         url_key='rows_per_page')
         #horizontal or vertical
         display_type = stp.radio('Caption Type',
                                  options=['vertical', 'horizontal'],
@@ -190,6 +215,7 @@ def get_params() -> FragmentParams:
         row_padding=row_padding,
         column_padding=column_padding,
         show_borders=show_borders,
+        rows_per_page=rows_per_page,
         display_type=display_type,
         a_color=a_color,
         b_color=b_color,
@@ -1,3 +1,5 @@
+import os
+
 # Default values for the application
 DEFAULT_PEPTIDE = '[Acetyl]-PEPT[+123]IDES'
 DEFAULT_CHARGE = 2
@@ -10,9 +12,23 @@ DEFAULT_PRECISION = 5
 DEFAULT_ROW_PADDING = 5
 DEFAULT_COLUMN_PADDING = 8
 DEFAULT_SHOW_BORDERS = False
+DEFAULT_ROWS_PER_PAGE = 100
+DEFAULT_SPECTRUM_BINS = 800
 DEFAULT_A_COLOR = '#8c564b'
 DEFAULT_B_COLOR = '#1f77b4'
 DEFAULT_C_COLOR = '#2ca02c'
 DEFAULT_X_COLOR = '#ff7f0e'
 DEFAULT_Y_COLOR = '#d62728'
-DEFAULT_Z_COLOR = '#9467bd'
\ No newline at end of file
+DEFAULT_Z_COLOR = '#9467bd'
+
+# Deployment settings, configured through environment variables
+FRAGMENT_ENGINE = os.environ.get('PEPFRAG_FRAGMENT_ENGINE', 'peptacular')
+SHADOW_SAMPLE_RATE = float(os.environ.get('PEPFRAG_SHADOW_SAMPLE_RATE', '0.0'))
+SHADOW_TOLERANCE = float(os.environ.get('PEPFRAG_SHADOW_TOLERANCE', '1e-6'))
+SHADOW_MAX_PENDING = int(os.environ.get('PEPFRAG_SHADOW_MAX_PENDING', '16'))
+MEMORY_BUDGET_MB = float(os.environ.get('PEPFRAG_MEMORY_BUDGET_MB', '512'))
+SHOW_DIAGNOSTICS = os.environ.get('PEPFRAG_SHOW_DIAGNOSTICS', 'false').lower() in ('1', 'true', 'yes')
+FRAGMENT_CACHE_SHARE = float(os.environ.get('PEPFRAG_FRAGMENT_CACHE_SHARE', '0.25'))
+SPECULATION = os.environ.get('PEPFRAG_SPECULATION', 'true').lower() in ('1', 'true', 'yes')
+SPECULATION_WORKERS = int(os.environ.get('PEPFRAG_SPECULATION_WORKERS', '2'))
+SPECULATION_CPU_BUDGET = float(os.environ.get('PEPFRAG_SPECULATION_CPU_BUDGET', '0.25'))
@@ -0,0 +1,220 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import peptacular as pt
+
+from fragment_utils import create_fragment_table, create_ladder_df, apply_table_styling, get_default_colors
+
+# ProForma 2.0 cross-link notation, e.g. EMEVTK[XLMOD:02001#XL1]SESPEK//EMEVTK[#XL1]SESPEK
+CROSSLINK_SEPARATOR = '//'
+
+
+def is_crosslinked(sequence: str) -> bool:
+    """Check if a sequence is written in ProForma cross-link notation"""
+    return CROSSLINK_SEPARATOR in sequence
+
+
+def split_chains(sequence: str) -> List[str]:
+    """Split a cross-linked sequence into its chains. A linear sequence is a single chain"""
+    return sequence.split(CROSSLINK_SEPARATOR)
+
+
+def map_chains(sequence: str, func: Callable[[str], str]) -> str:
+    """Apply a sequence transformation to every chain of a (possibly cross-linked) sequence"""
+    return CROSSLINK_SEPARATOR.join(func(chain) for chain in split_chains(sequence))
+
+
+def find_link_site(sequence: str) -> Optional[Tuple[int, str]]:
+    """
+    Find the cross-linked residue of a chain
+
+    Args:
+        sequence: A single chain, with the link marked by a group label, e.g. K[XLMOD:02001#XL1] or K[#XL1]
+
+    Returns:
+        Tuple of the 0-based residue index and the group label, or None if the chain has no label
+    """
+    annotation = pt.parse(sequence)
+    if not annotation.has_internal_mods():
+        return None
+
+    for index, mods in sorted(annotation.internal_mods.items()):
+        for mod in mods:
+            if '#' in str(mod.val):
+                return index, str(mod.val).split('#', 1)[1]
+    return None
+
+
+def find_link_sites(sequence: str) -> Tuple[int, int]:
+    """
+    Find the cross-linked residues of both chains of a cross-linked sequence
+
+    Returns:
+        Tuple of the 0-based link residue index in the first and second chain
+
+    Raises:
+        ValueError: If the sequence is not two chains joined by one matching group label
+    """
+    chains = split_chains(sequence)
+    if len(chains) != 2:
+        raise ValueError(f'Cross-linked sequences must contain exactly two chains, found {len(chains)}')
+
+    sites = [find_link_site(chain) for chain in chains]
+    if any(site is None for site in sites):
+        raise ValueError('Both chains must mark the cross-linked residue with a group label, e.g. K[#XL1]')
+
+    (alpha_site, alpha_label), (beta_site, beta_label) = sites
+    if alpha_label != beta_label:
+        raise ValueError(f'Cross-link labels do not match: #{alpha_label} and #{beta_label}')
+
+    return alpha_site, beta_site
+
+
+def add_linked_mass(frag_df: pd.DataFrame, site: int, linked_mass: float) -> pd.DataFrame:
+    """Add the mass of the linked chain to every fragment that contains the link site"""
+    linked = (frag_df['start'] <= site) & (frag_df['end'] > site)
+    offset = linked.to_numpy() * linked_mass
+    charge = frag_df['charge'].to_numpy()
+    # at charge 0 the m/z column holds the neutral mass, matching pt.fragment
+    mz_offset = np.divide(offset, charge, out=offset.copy(), where=charge > 0)
+    return frag_df.assign(
+        linked=linked,
+        mz=frag_df['mz'] + mz_offset,
+        mass=frag_df['mass'] + offset,
+        neutral_mass=frag_df['neutral_mass'] + offset,
+    )
+
+
+def create_crosslink_fragments(
+        alpha: str,
+        beta: str,
+        alpha_site: int,
+        beta_site: int,
+        ion_types: List[str],
+        charges: List[int],
+        monoisotopic: bool,
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Create fragment tables for both chains of a cross-linked peptide
+
+    Each chain is fragmented once. Fragments that contain the link site carry the full neutral mass of the other
+    chain, which is added as an offset. The linker mass is part of whichever chain carries the linker modification.
+
+    Args:
+        alpha: The first chain
+        beta: The second chain
+        alpha_site: 0-based index of the cross-linked residue in the first chain
+        beta_site: 0-based index of the cross-linked residue in the second chain
+        ion_types: List of ion types to generate (a, b, c, x, y, z)
+        charges: List of charge states
+        monoisotopic: Whether to use monoisotopic masses
+
+    Returns:
+        Dictionary mapping 'alpha' and 'beta' to the fragment data and DataFrame of fragments of that chain
+    """
+    alpha_mass = pt.mass(alpha, monoisotopic=monoisotopic, ion_type='p', charge=0)
+    beta_mass = pt.mass(beta, monoisotopic=monoisotopic, ion_type='p', charge=0)
+
+    tables = {}
+    for chain, sequence, site, linked_mass in (('alpha', alpha, alpha_site, beta_mass),
+                                                ('beta', beta, beta_site, alpha_mass)):
+        fragments, frag_df = create_fragment_table(sequence, ion_types, charges, monoisotopic, cached=True)
+        if frag_df.empty:
+            tables[chain] = (fragments, frag_df)
+            continue
+        tables[chain] = (add_linked_mass(fragments, site, linked_mass).assign(chain=chain),
+                         add_linked_mass(frag_df, site, linked_mass))
+    return tables
+
+
+def crosslink_precursor_mass(alpha: str, beta: str, monoisotopic: bool) -> float:
+    """Neutral mass of the cross-linked precursor"""
+    return (pt.mass(alpha, monoisotopic=monoisotopic, ion_type='p', charge=0) +
+            pt.mass(beta, monoisotopic=monoisotopic, ion_type='p', charge=0))
+
+
+def style_crosslink_tables(
+        alpha: str,
+        beta: str,
+        alpha_site: int,
+        beta_site: int,
+        fragment_types: List[str],
+        charge: int,
+        is_monoisotopic: bool,
+        color_map: Optional[Dict[str, str]] = None,
+        show_borders: bool = True,
+        aa_col: Optional[str] = "Seq",
+        pos_col: Optional[str] = "#>",
+        neg_col: Optional[str] = "<#",
+        decimal_places: int = 4,
+        row_padding: int = 4,
+        column_padding: int = 10,
+        min_mass: Optional[float] = None,
+        max_mass: Optional[float] = None,
+):
+    """
+    Style the two linked fragment ladders of a cross-linked peptide for display
+
+    Args:
+        alpha: The first chain
+        beta: The second chain
+        alpha_site: 0-based index of the cross-linked residue in the first chain
+        beta_site: 0-based index of the cross-linked residue in the second chain
+        fragment_types: List of ion types to generate (a, b, c, x, y, z)
+        charge: Charge state
+        is_monoisotopic: Whether to use monoisotopic masses
+        color_map: Dictionary mapping ion types to colors
+        show_borders: Whether to show borders
+        aa_col: Column name for amino acid sequence
+        pos_col: Column name for position index (forward)
+        neg_col: Column name for position index (reverse)
+        decimal_places: Number of decimal places to display
+        row_padding: Padding for rows
+        column_padding: Padding for columns
+        min_mass: Minimum mass to highlight
+        max_mass: Maximum mass to highlight
+
+    Returns:
+        List of the two styled DataFrames and DataFrame of the fragment data of both chains
+    """
+    default_colors = get_default_colors(color_map)
+
+    tables = create_crosslink_fragments(alpha, beta, alpha_site, beta_site, fragment_types, [charge],
+                                        is_monoisotopic)
+
+    styled_tables = []
+    for chain, sequence, site in (('alpha', alpha, alpha_site), ('beta', beta, beta_site)):
+        _, frag_df = tables[chain]
+        if frag_df.empty:
+            import streamlit as st
+            st.warning("No fragments found. Please check your input and try again.")
+            st.stop()
+
+        df, forward_cols, reverse_cols = create_ladder_df(frag_df, sequence, fragment_types, charge,
+                                                          aa_col, pos_col, neg_col)
+
+        styled_df = apply_table_styling(
+            df=df,
+            forward_cols=forward_cols,
+            reverse_cols=reverse_cols,
+            default_colors=default_colors,
+            show_borders=show_borders,
+            caption=f'{"α" if chain == "alpha" else "β"} chain, linked at residue {site + 1}',
+            decimal_places=decimal_places,
+            row_padding=row_padding,
+            column_padding=column_padding,
+            min_mass=min_mass,
+            max_mass=max_mass,
+        )
+
+        # Mark the cross-linked residue
+        if aa_col:
+            styled_df = styled_df.map(lambda val: 'text-decoration: underline; font-weight: bold;',
+                                      subset=pd.IndexSlice[[site], [aa_col]])
+
+        styled_tables.append(styled_df)
+
+    frag_data = pd.concat([tables['alpha'][0], tables['beta'][0]], ignore_index=True)
+    return styled_tables, frag_data
+
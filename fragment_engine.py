@@ -0,0 +1,236 @@
+"""
+Selectable fragment engines with sampled shadow verification.
+
+The engine is chosen with the PEPFRAG_FRAGMENT_ENGINE environment variable:
+    peptacular  - pt.fragment, the reference implementation (default)
+    prefix_sum  - cumulative residue masses, computed once per sequence
+
+When a non-reference engine is active, PEPFRAG_SHADOW_SAMPLE_RATE of requests are also run
+through pt.fragment on a background thread and the m/z values are compared within
+PEPFRAG_SHADOW_TOLERANCE. Mismatches are logged with the offending sequence.
+"""
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+import peptacular as pt
+
+import instrumentation
+from constants import (FRAGMENT_ENGINE, SHADOW_SAMPLE_RATE, SHADOW_TOLERANCE, SHADOW_MAX_PENDING)
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_ENGINE = 'peptacular'
+FORWARD_ION_TYPES = 'abc'
+REVERSE_ION_TYPES = 'xyz'
+
+SHADOW_STATS = {'submitted': 0, 'skipped': 0, 'matched': 0, 'mismatched': 0, 'failed': 0}
+_shadow_lock = threading.Lock()
+_shadow_pending = 0
+_shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pepfrag-shadow')
+
+
+def peptacular_fragment(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool) -> pd.DataFrame:
+    """Fragment a sequence with pt.fragment"""
+    fragments = pt.fragment(sequence=sequence,
+                            ion_types=ion_types,
+                            charges=charges,
+                            monoisotopic=monoisotopic)
+
+    # convert list of dataclasses to list of dicts
+    return pd.DataFrame([fragment.to_dict() for fragment in fragments])
+
+
+@lru_cache(maxsize=4096)
+def _component_mass(component: str, monoisotopic: bool) -> float:
+    return pt.mass(component, monoisotopic=monoisotopic, ion_type='p', charge=0)
+
+
+@lru_cache(maxsize=4096)
+def _terminal_mz(component: str, ion_type: str, charge: int, monoisotopic: bool) -> float:
+    return pt.mz(component, monoisotopic=monoisotopic, ion_type=ion_type, charge=charge)
+
+
+@lru_cache(maxsize=2)
+def _water_mass(monoisotopic: bool) -> float:
+    # a precursor is its residues plus one water, so G + G - GG leaves exactly one water
+    return 2 * _component_mass('G', monoisotopic) - _component_mass('GG', monoisotopic)
+
+
+def prefix_sum_fragment(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool) -> pd.DataFrame:
+    """
+    Fragment a sequence from cumulative residue masses
+
+    Only the terminal residue of each ion series is passed through peptacular (which accounts for
+    terminal mods and ion type offsets); every longer fragment adds the residue masses in between.
+    Labile mods are not included in fragment masses, matching pt.fragment. Sequences with global
+    isotope mods, intervals or unknown mods are not split into residues and use pt.fragment instead.
+    """
+    annotation = pt.parse(sequence)
+    if annotation.has_isotope_mods() or annotation.has_intervals() or annotation.has_unknown_mods():
+        return peptacular_fragment(sequence, ion_types, charges, monoisotopic)
+
+    annotation.pop_labile_mods()
+    components = pt.split(annotation.serialize(include_plus=True), include_plus=True)
+    n = len(components)
+
+    water = _water_mass(monoisotopic)
+    residue_masses = np.array([_component_mass(c, monoisotopic) - water for c in components])
+
+    # forward_extra[i] is the mass added to the first residue for a fragment of length i + 1
+    forward_extra = np.concatenate(([0.0], np.cumsum(residue_masses[1:])))
+    reverse_extra = np.concatenate(([0.0], np.cumsum(residue_masses[:-1][::-1])))
+    lengths = np.arange(1, n + 1)
+
+    columns = {'charge': [], 'ion_type': [], 'start': [], 'end': [], 'mz': [], 'number': []}
+    for ion_type in ion_types:
+        if ion_type in FORWARD_ION_TYPES:
+            anchor, extra = components[0], forward_extra
+            starts, ends = np.zeros(n, dtype=int), lengths
+        elif ion_type in REVERSE_ION_TYPES:
+            anchor, extra = components[-1], reverse_extra
+            starts, ends = n - lengths, np.full(n, n)
+        else:
+            raise ValueError(f'Unsupported ion type for the prefix_sum engine: {ion_type}')
+
+        # longest fragments first, matching the order of pt.fragment
+        for charge in charges:
+            columns['charge'].append(np.full(n, charge))
+            columns['ion_type'].append(np.full(n, ion_type, dtype=object))
+            columns['start'].append(starts[::-1])
+            columns['end'].append(ends[::-1])
+            # at charge 0 peptacular reports the neutral mass as m/z
+            columns['mz'].append((_terminal_mz(anchor, ion_type, charge, monoisotopic) + extra / max(charge, 1))[::-1])
+            columns['number'].append(lengths[::-1])
+
+    if not columns['mz']:
+        return pd.DataFrame()
+
+    columns = {name: np.concatenate(arrays) for name, arrays in columns.items()}
+    charge, mz = columns['charge'], columns['mz']
+    mass = np.where(charge > 0, mz * charge, mz)
+
+    return pd.DataFrame({
+        'charge': charge,
+        'ion_type': columns['ion_type'],
+        'start': columns['start'],
+        'end': columns['end'],
+        'monoisotopic': monoisotopic,
+        'isotope': 0,
+        'loss': 0.0,
+        'parent_sequence': sequence,
+        'mass': mass,
+        'neutral_mass': mass - charge * pt.PROTON_MASS,
+        'mz': mz,
+        'internal': False,
+        'label': ['+' * z + t + str(length) for z, t, length in zip(charge, columns['ion_type'], columns['number'])],
+        'number': columns['number'],
+    })
+
+
+ENGINES: Dict[str, Callable[[str, List[str], List[int], bool], pd.DataFrame]] = {
+    REFERENCE_ENGINE: peptacular_fragment,
+    'prefix_sum': prefix_sum_fragment,
+}
+
+
+def compare_fragments(frag_df: pd.DataFrame, reference_df: pd.DataFrame, tolerance: float) -> bool:
+    """Check that two fragment tables contain the same ions with m/z values within tolerance"""
+    keys = ['ion_type', 'charge', 'start', 'end']
+    if len(frag_df) != len(reference_df):
+        return False
+    if frag_df.empty:
+        return True
+
+    frag_df = frag_df.sort_values(keys)
+    reference_df = reference_df.sort_values(keys)
+
+    for key in keys:
+        if not np.array_equal(frag_df[key].to_numpy(), reference_df[key].to_numpy()):
+            return False
+
+    return bool(np.allclose(frag_df['mz'].to_numpy(), reference_df['mz'].to_numpy(), rtol=0, atol=tolerance))
+
+
+def _shadow_compare(frag_df: pd.DataFrame, sequence: str, ion_types: List[str], charges: List[int],
+                    monoisotopic: bool, engine: str) -> None:
+    global _shadow_pending
+    try:
+        reference_df = peptacular_fragment(sequence, ion_types, charges, monoisotopic)
+        matched = compare_fragments(frag_df, reference_df, SHADOW_TOLERANCE)
+        with _shadow_lock:
+            SHADOW_STATS['matched' if matched else 'mismatched'] += 1
+        if not matched:
+            logger.warning('Fragment engine %r does not match %r for sequence=%r ion_types=%r charges=%r '
+                           'monoisotopic=%r', engine, REFERENCE_ENGINE, sequence, ion_types, charges, monoisotopic)
+    except Exception:
+        with _shadow_lock:
+            SHADOW_STATS['failed'] += 1
+        logger.exception('Shadow verification failed for sequence=%r', sequence)
+    finally:
+        with _shadow_lock:
+            _shadow_pending -= 1
+
+
+def _submit_shadow(frag_df: pd.DataFrame, sequence: str, ion_types: List[str], charges: List[int],
+                   monoisotopic: bool, engine: str) -> None:
+    global _shadow_pending
+    with _shadow_lock:
+        # never let a backlog of shadow checks build up behind slow reference runs
+        if _shadow_pending >= SHADOW_MAX_PENDING:
+            SHADOW_STATS['skipped'] += 1
+            return
+        _shadow_pending += 1
+        SHADOW_STATS['submitted'] += 1
+
+    _shadow_executor.submit(_shadow_compare, frag_df.copy(), sequence, list(ion_types), list(charges),
+                            monoisotopic, engine)
+
+
+def shadow_stats() -> Dict[str, int]:
+    """Current shadow verification counts"""
+    with _shadow_lock:
+        return dict(SHADOW_STATS, pending=_shadow_pending)
+
+
+instrumentation.register('shadow_verification', shadow_stats)
+
+
+def sample_shadow(frag_df: pd.DataFrame, sequence: str, ion_types: List[str], charges: List[int],
+                  monoisotopic: bool, engine: str) -> None:
+    """Check SHADOW_SAMPLE_RATE of results from a non-reference engine against pt.fragment"""
+    if engine != REFERENCE_ENGINE and SHADOW_SAMPLE_RATE > 0 and random.random() < SHADOW_SAMPLE_RATE:
+        _submit_shadow(frag_df, sequence, ion_types, charges, monoisotopic, engine)
+
+
+def fragment(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool,
+             engine: str = FRAGMENT_ENGINE, verify: bool = True) -> pd.DataFrame:
+    """
+    Fragment a sequence with the configured engine
+
+    Args:
+        sequence: The peptide sequence
+        ion_types: List of ion types to generate (a, b, c, x, y, z)
+        charges: List of charge states
+        monoisotopic: Whether to use monoisotopic masses
+        engine: Name of the engine to use, defaults to PEPFRAG_FRAGMENT_ENGINE
+        verify: Whether to sample this call for shadow verification, callers that assemble a result from
+            several calls sample the result once instead
+
+    Returns:
+        DataFrame with one row per fragment
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown fragment engine: {engine}. Choose from {sorted(ENGINES)}')
+
+    frag_df = ENGINES[engine](sequence, ion_types, charges, monoisotopic)
+
+    if verify:
+        sample_shadow(frag_df, sequence, ion_types, charges, monoisotopic, engine)
+
+    return frag_df
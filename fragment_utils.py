@@ -1,10 +1,14 @@
 from typing import List, Tuple, Optional, Dict
+import numpy as np
 import pandas as pd
 import peptacular as pt
 
+from fragment_engine import fragment
+from speculation import cached_fragment
 
-def create_fragment_table(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool) -> Tuple[
-    List, pd.DataFrame]:
+
+def create_fragment_table(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool,
+                          cached: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Create a fragment table for a given peptide sequence
 
@@ -13,67 +17,36 @@ def create_fragment_table(sequence: str, ion_types: List[str], charges: List[int
         ion_types: List of ion types to generate (a, b, c, x, y, z)
         charges: List of charge states
         monoisotopic: Whether to use monoisotopic masses
+        cached: Whether to reuse (and fill) the fragment cache shared with speculative precomputation
 
     Returns:
-        Tuple containing list of fragment objects and DataFrame of fragments
+        Tuple containing the fragment data from the fragment engine and DataFrame of fragments
     """
-    fragments = pt.fragment(sequence=sequence,
-                            ion_types=ion_types,
-                            charges=charges,
-                            monoisotopic=monoisotopic)
-
-    # convert list of dataclasses to list of dicts
-    frag_df = pd.DataFrame([fragment.to_dict() for fragment in fragments])
+    fragment_func = cached_fragment if cached else fragment
+    fragments = fragment_func(sequence=sequence,
+                              ion_types=ion_types,
+                              charges=charges,
+                              monoisotopic=monoisotopic)
 
-    frag_df['number'] = None
-    # for forward ions (a,b,c) set number to frag.end
-    frag_df['number'] = frag_df.apply(lambda row: row['end'] if row['ion_type'] in 'abc' else row['number'], axis=1)
+    frag_df = fragments.copy()
+    if frag_df.empty:
+        return fragments, frag_df
 
-    # for reverse ions (x,y,z) set number to frag.start
-    frag_df['number'] = frag_df.apply(lambda row: row['start'] if row['ion_type'] in 'xyz' else row['number'], axis=1)
+    # for forward ions (a,b,c) set number to frag.end, for reverse ions (x,y,z) set number to frag.start
+    frag_df['number'] = np.where(frag_df['ion_type'].isin(list('abc')), frag_df['end'], frag_df['start'])
 
     return fragments, frag_df
 
 
-def style_fragment_table(
-        sequence: str,
-        fragment_types: List[str],
-        charge: int,
-        is_monoisotopic: bool,
-        color_map: Optional[Dict[str, str]] = None,
-        show_borders: bool = True,
-        aa_col: Optional[str] = "Seq",
-        pos_col: Optional[str] = "#>",
-        neg_col: Optional[str] = "<#",
-        caption: Optional[str] = None,
-        decimal_places: int = 4,
-        row_padding: int = 4,
-        column_padding: int = 10,
-        min_mass: Optional[float] = None,
-        max_mass: Optional[float] = None,
-):
+def get_default_colors(color_map: Optional[Dict[str, str]] = None) -> Dict[str, str]:
     """
-    Style a fragment table for display
+    Get the ion type colors, updated with a user color map
 
     Args:
-        sequence: The peptide sequence
-        fragment_types: List of ion types to generate (a, b, c, x, y, z)
-        charge: Charge state
-        is_monoisotopic: Whether to use monoisotopic masses
         color_map: Dictionary mapping ion types to colors
-        show_borders: Whether to show borders
-        aa_col: Column name for amino acid sequence
-        pos_col: Column name for position index (forward)
-        neg_col: Column name for position index (reverse)
-        caption: Caption for the table
-        decimal_places: Number of decimal places to display
-        row_padding: Padding for rows
-        column_padding: Padding for columns
-        min_mass: Minimum mass to highlight
-        max_mass: Maximum mass to highlight
 
     Returns:
-        Styled DataFrame for display
+        Dictionary mapping upper case ion types to colors
     """
     # Define default colors
     default_colors = {
@@ -90,14 +63,33 @@ def style_fragment_table(
         color_map = {k.upper(): v for k, v in color_map.items()}
         default_colors.update(color_map)
 
-    # Generate fragment data
-    fragments, frag_df = create_fragment_table(sequence, fragment_types, [charge], is_monoisotopic)
+    return default_colors
 
-    if frag_df.empty:
-        import streamlit as st
-        st.warning("No fragments found. Please check your input and try again.")
-        st.stop()
 
+def create_ladder_df(
+        frag_df: pd.DataFrame,
+        sequence: str,
+        fragment_types: List[str],
+        charge: int,
+        aa_col: Optional[str] = "Seq",
+        pos_col: Optional[str] = "#>",
+        neg_col: Optional[str] = "<#",
+) -> Tuple[pd.DataFrame, List[str], List[str]]:
+    """
+    Arrange fragments into a ladder with one row per residue
+
+    Args:
+        frag_df: DataFrame of fragments from create_fragment_table
+        sequence: The peptide sequence
+        fragment_types: List of ion types to show (a, b, c, x, y, z)
+        charge: Charge state
+        aa_col: Column name for amino acid sequence
+        pos_col: Column name for position index (forward)
+        neg_col: Column name for position index (reverse)
+
+    Returns:
+        Tuple containing the ladder DataFrame, forward ion columns and reverse ion columns
+    """
     # Drop unnecessary columns
     frag_df = frag_df.drop(columns=['isotope', 'loss', 'parent_sequence'])
     frag_df.sort_values(by=['charge', 'ion_type', 'start'], inplace=True)
@@ -136,6 +128,62 @@ def style_fragment_table(
     if neg_col and reverse_cols:
         df[neg_col] = list(range(len(df), 0, -1))
 
+    return df, forward_cols, reverse_cols
+
+
+def style_fragment_table(
+        sequence: str,
+        fragment_types: List[str],
+        charge: int,
+        is_monoisotopic: bool,
+        color_map: Optional[Dict[str, str]] = None,
+        show_borders: bool = True,
+        aa_col: Optional[str] = "Seq",
+        pos_col: Optional[str] = "#>",
+        neg_col: Optional[str] = "<#",
+        caption: Optional[str] = None,
+        decimal_places: int = 4,
+        row_padding: int = 4,
+        column_padding: int = 10,
+        min_mass: Optional[float] = None,
+        max_mass: Optional[float] = None,
+):
+    """
+    Style a fragment table for display
+
+    Args:
+        sequence: The peptide sequence
+        fragment_types: List of ion types to generate (a, b, c, x, y, z)
+        charge: Charge state
+        is_monoisotopic: Whether to use monoisotopic masses
+        color_map: Dictionary mapping ion types to colors
+        show_borders: Whether to show borders
+        aa_col: Column name for amino acid sequence
+        pos_col: Column name for position index (forward)
+        neg_col: Column name for position index (reverse)
+        caption: Caption for the table
+        decimal_places: Number of decimal places to display
+        row_padding: Padding for rows
+        column_padding: Padding for columns
+        min_mass: Minimum mass to highlight
+        max_mass: Maximum mass to highlight
+
+    Returns:
+        Styled DataFrame for display and the fragment data it was built from
+    """
+    default_colors = get_default_colors(color_map)
+
+    # Generate fragment data
+    fragments, frag_df = create_fragment_table(sequence, fragment_types, [charge], is_monoisotopic, cached=True)
+
+    if frag_df.empty:
+        import streamlit as st
+        st.warning("No fragments found. Please check your input and try again.")
+        st.stop()
+
+    df, forward_cols, reverse_cols = create_ladder_df(frag_df, sequence, fragment_types, charge,
+                                                      aa_col, pos_col, neg_col)
+
     # Apply styling
     return apply_table_styling(
         df=df,
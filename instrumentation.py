@@ -0,0 +1,28 @@
+"""
+Process-wide instrumentation surface.
+
+Modules register a provider returning a dict of current statistics, and snapshot() collects them
+all. The snapshot is shown in the app when PEPFRAG_SHOW_DIAGNOSTICS is enabled.
+"""
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_PROVIDERS: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Register a statistics provider under a name, replacing any previous provider"""
+    _PROVIDERS[name] = provider
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Collect the current statistics from every registered provider"""
+    stats = {}
+    for name, provider in _PROVIDERS.items():
+        try:
+            stats[name] = provider()
+        except Exception:
+            logger.exception('Instrumentation provider %r failed', name)
+    return stats
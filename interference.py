@@ -0,0 +1,173 @@
+"""
+Co-isolation interference check for DIA and PRM method design.
+
+Finds pairs of target precursors that fall within the same isolation window and share fragment ions
+within tolerance. Candidate pairs come from a sweep over the precursors sorted by m/z, so only
+precursors that actually co-isolate are compared, and fragments are matched with a binary search
+over each precursor's sorted fragment m/z array.
+
+Usage:
+    python interference.py peptides.txt --charges 2 3 --isolation-width 2.0 --tolerance 0.02 -o interference.csv
+"""
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import peptacular as pt
+
+from constants import FRAGMENT_ENGINE
+from fragment_engine import ENGINES, fragment
+from library_export import read_peptides
+
+logger = logging.getLogger(__name__)
+
+RESULT_COLUMNS = ['peptide_1', 'charge_1', 'precursor_mz_1', 'peptide_2', 'charge_2', 'precursor_mz_2',
+                  'delta_mz', 'shared_fragments', 'fragments_1', 'fragments_2']
+
+
+def fragment_mz_array(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool,
+                      engine: str = FRAGMENT_ENGINE) -> Tuple[np.ndarray, np.ndarray]:
+    """Fragment m/z values of a sequence sorted ascending, and their charges, excluding the full length ions"""
+    frag_df = fragment(sequence, ion_types, charges, monoisotopic, engine=engine)
+    if frag_df.empty:
+        return np.empty(0), np.empty(0, dtype=int)
+    partial = ((frag_df['end'] - frag_df['start']) < len(pt.strip_mods(sequence))).to_numpy()
+    mz, charge = frag_df['mz'].to_numpy()[partial], frag_df['charge'].to_numpy()[partial]
+    order = np.argsort(mz)
+    return mz[order], charge[order]
+
+
+def count_shared(mz_1: np.ndarray, mz_2: np.ndarray, tolerance: float) -> int:
+    """Number of fragments in mz_1 with a fragment in mz_2 within tolerance. Both arrays must be sorted"""
+    if len(mz_1) == 0 or len(mz_2) == 0:
+        return 0
+    # the first fragment of mz_2 at or above mz - tolerance is the only one that can match
+    idx = np.searchsorted(mz_2, mz_1 - tolerance, side='left')
+    idx = np.minimum(idx, len(mz_2) - 1)
+    return int(np.count_nonzero(np.abs(mz_2[idx] - mz_1) <= tolerance))
+
+
+def co_isolating_pairs(precursor_mz: np.ndarray, max_delta: float) -> Iterator[Tuple[int, int]]:
+    """
+    Pairs of precursors whose m/z differ by at most max_delta, by a sweep over the sorted m/z values
+
+    Yields:
+        Index pairs into precursor_mz, lower m/z first
+    """
+    order = np.argsort(precursor_mz, kind='stable')
+    sorted_mz = precursor_mz[order]
+    # for each precursor, the end of the run of precursors within max_delta above it
+    window_end = np.searchsorted(sorted_mz, sorted_mz + max_delta, side='right')
+    for i, end in enumerate(window_end):
+        for j in range(i + 1, end):
+            yield int(order[i]), int(order[j])
+
+
+def find_interference(peptides: List[str],
+                      precursor_charges: List[int],
+                      isolation_width: float = 2.0,
+                      tolerance: float = 0.02,
+                      ion_types: Optional[List[str]] = None,
+                      max_fragment_charge: int = 2,
+                      min_shared: int = 1,
+                      monoisotopic: bool = True,
+                      engine: str = FRAGMENT_ENGINE) -> pd.DataFrame:
+    """
+    Find co-isolating precursor pairs that share fragment ions
+
+    Args:
+        peptides: ProForma peptide sequences
+        precursor_charges: Charge states to consider for every peptide
+        isolation_width: Width of an isolation window centred on each target, so precursors within half
+            this m/z distance are co-isolated
+        tolerance: Fragment m/z tolerance
+        ion_types: Fragment ion types, defaults to b and y
+        max_fragment_charge: Fragment charges range from 1 to min(precursor charge - 1, max_fragment_charge)
+        min_shared: Minimum number of shared fragments to report a pair
+        monoisotopic: Whether to use monoisotopic masses
+        engine: Name of the fragment engine to use
+
+    Returns:
+        DataFrame with one row per interfering pair
+    """
+    ion_types = ion_types or ['b', 'y']
+
+    precursors = []
+    for peptide in dict.fromkeys(peptides):
+        try:
+            for charge in precursor_charges:
+                mz = pt.mz(peptide, monoisotopic=monoisotopic, ion_type='p', charge=charge)
+                precursors.append((peptide, charge, mz))
+        except Exception as err:
+            logger.warning('Skipping peptide %r: %s', peptide, err)
+
+    if not precursors:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    precursor_mz = np.array([mz for _, _, mz in precursors])
+
+    # fragments are only computed for precursors that co-isolate with something, once per peptide at every
+    # fragment charge; each precursor charge then keeps its own subset, which stays sorted
+    fragment_charges = list(range(1, max_fragment_charge + 1))
+    peptide_fragments: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    precursor_fragments: Dict[int, np.ndarray] = {}
+
+    def fragments_of(index: int) -> np.ndarray:
+        if index not in precursor_fragments:
+            peptide, charge, _ = precursors[index]
+            if peptide not in peptide_fragments:
+                peptide_fragments[peptide] = fragment_mz_array(peptide, ion_types, fragment_charges,
+                                                               monoisotopic, engine)
+            mz, frag_charge = peptide_fragments[peptide]
+            precursor_fragments[index] = mz[frag_charge <= max(charge - 1, 1)]
+        return precursor_fragments[index]
+
+    rows = []
+    # a window of this width centred on either precursor reaches isolation_width / 2 to each side
+    for i, j in co_isolating_pairs(precursor_mz, isolation_width / 2):
+        peptide_1, charge_1, mz_1 = precursors[i]
+        peptide_2, charge_2, mz_2 = precursors[j]
+        if peptide_1 == peptide_2:
+            continue
+
+        frags_1, frags_2 = fragments_of(i), fragments_of(j)
+        shared = count_shared(frags_1, frags_2, tolerance)
+        if shared >= min_shared:
+            rows.append((peptide_1, charge_1, mz_1, peptide_2, charge_2, mz_2, abs(mz_2 - mz_1),
+                         shared, len(frags_1), len(frags_2)))
+
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Find co-isolating precursors that share fragment ions')
+    parser.add_argument('peptides', help='Text file with one ProForma peptide per line')
+    parser.add_argument('-o', '--output', default='interference.csv', help='Output CSV file')
+    parser.add_argument('--charges', type=int, nargs='+', default=[2, 3], help='Precursor charge states')
+    parser.add_argument('--isolation-width', type=float, default=2.0,
+                        help='Isolation window width (m/z), centred on each target')
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Fragment m/z tolerance')
+    parser.add_argument('--ion-types', nargs='+', default=['b', 'y'], choices=list('abcxyz'), help='Ion types')
+    parser.add_argument('--max-fragment-charge', type=int, default=2, help='Highest fragment charge state')
+    parser.add_argument('--min-shared', type=int, default=1, help='Minimum shared fragments to report a pair')
+    parser.add_argument('--average', action='store_true', help='Use average instead of monoisotopic masses')
+    parser.add_argument('--engine', default=FRAGMENT_ENGINE, choices=sorted(ENGINES), help='Fragment engine')
+    args = parser.parse_args(argv)
+
+    result = find_interference(peptides=list(read_peptides(args.peptides)),
+                               precursor_charges=args.charges,
+                               isolation_width=args.isolation_width,
+                               tolerance=args.tolerance,
+                               ion_types=args.ion_types,
+                               max_fragment_charge=args.max_fragment_charge,
+                               min_shared=args.min_shared,
+                               monoisotopic=not args.average,
+                               engine=args.engine)
+    result.to_csv(args.output, index=False)
+    print(f'Wrote {len(result)} interfering precursor pairs to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""
+Batch export of targeted-assay transition lists and MSP spectral libraries.
+
+Takes a file with one ProForma peptide per line, fragments every precursor charge, keeps the best
+transitions per precursor and writes a vendor-neutral transition list (TSV) and an MSP library.
+Peptides are processed in shards by a process pool; each shard is written to its own part files
+and the parts are concatenated in input order once all shards finish.
+
+Usage:
+    python library_export.py peptides.txt --charges 2 3 --ion-types b y --top-n 6 -o library
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import peptacular as pt
+
+from constants import FRAGMENT_ENGINE
+from fragment_engine import ENGINES, fragment
+
+logger = logging.getLogger(__name__)
+
+TRANSITION_COLUMNS = ['PrecursorMz', 'ProductMz', 'LibraryIntensity', 'PeptideSequence', 'ModifiedPeptideSequence',
+                      'PrecursorCharge', 'ProductCharge', 'FragmentType', 'FragmentSeriesNumber', 'TransitionRank']
+
+# y ions dominate most CID/HCD spectra, so they are ranked ahead of the other series
+ION_TYPE_PRIORITY = {'y': 5, 'b': 4, 'z': 3, 'c': 2, 'x': 1, 'a': 0}
+
+
+@dataclass
+class ExportPolicy:
+    precursor_charges: List[int] = field(default_factory=lambda: [2, 3])
+    ion_types: List[str] = field(default_factory=lambda: ['b', 'y'])
+    max_fragment_charge: int = 2
+    min_mz: Optional[float] = None
+    max_mz: Optional[float] = None
+    min_length: int = 3
+    top_n: int = 6
+    monoisotopic: bool = True
+    engine: str = FRAGMENT_ENGINE
+
+
+def fragment_precursors(peptides: List[str], policy: ExportPolicy) -> pd.DataFrame:
+    """
+    Fragment every precursor of a list of peptides
+
+    Fragment charges range from 1 up to one less than the precursor charge, capped at max_fragment_charge.
+    Full length fragments and fragments shorter than min_length are excluded.
+
+    Returns:
+        DataFrame with one row per candidate transition
+    """
+    fragment_charges = list(range(1, policy.max_fragment_charge + 1))
+    columns = {name: [] for name in ['ion_type', 'charge', 'start', 'end', 'mz', 'peptide', 'stripped',
+                                     'precursor_charge', 'neutral_mass', 'precursor_mz']}
+
+    for peptide in dict.fromkeys(peptides):
+        try:
+            frag_df = fragment(peptide, policy.ion_types, fragment_charges, policy.monoisotopic, engine=policy.engine)
+            neutral_mass = pt.mass(peptide, monoisotopic=policy.monoisotopic, ion_type='p', charge=0)
+            stripped = pt.strip_mods(peptide)
+        except Exception as err:
+            logger.warning('Skipping peptide %r: %s', peptide, err)
+            continue
+
+        if frag_df.empty:
+            continue
+
+        # work on plain arrays, a DataFrame per precursor costs more than fragmenting it
+        ion_type, charge, start, end, mz = (frag_df[col].to_numpy() for col in ['ion_type', 'charge', 'start', 'end', 'mz'])
+        length = end - start
+        valid = (length >= policy.min_length) & (length < len(stripped))
+
+        for precursor_charge in policy.precursor_charges:
+            keep = valid & (charge <= max(precursor_charge - 1, 1))
+            n_keep = int(keep.sum())
+            columns['ion_type'].append(ion_type[keep])
+            columns['charge'].append(charge[keep])
+            columns['start'].append(start[keep])
+            columns['end'].append(end[keep])
+            columns['mz'].append(mz[keep])
+            columns['peptide'].append(np.full(n_keep, peptide, dtype=object))
+            columns['stripped'].append(np.full(n_keep, stripped, dtype=object))
+            columns['precursor_charge'].append(np.full(n_keep, precursor_charge))
+            columns['neutral_mass'].append(np.full(n_keep, neutral_mass))
+            columns['precursor_mz'].append(
+                np.full(n_keep, (neutral_mass + precursor_charge * pt.PROTON_MASS) / precursor_charge))
+
+    if not columns['mz']:
+        return pd.DataFrame()
+
+    return pd.DataFrame({name: np.concatenate(arrays) for name, arrays in columns.items()})
+
+
+def rank_transitions(candidates: pd.DataFrame, policy: ExportPolicy) -> pd.DataFrame:
+    """
+    Pick the top transitions per precursor
+
+    Fragments are ranked by whether they fall above the precursor m/z (less chemical noise), then by
+    ion series, then by fragment length. Without spectra to draw from, library intensities are derived
+    from the rank.
+    """
+    if candidates.empty:
+        return candidates
+
+    mz = candidates['mz'].to_numpy()
+    in_bounds = np.ones(len(candidates), dtype=bool)
+    if policy.min_mz is not None:
+        in_bounds &= mz >= policy.min_mz
+    if policy.max_mz is not None:
+        in_bounds &= mz <= policy.max_mz
+    candidates = candidates[in_bounds]
+
+    # one group per precursor (peptides are unique after fragment_precursors), numbered in input order
+    group = candidates.groupby(['peptide', 'precursor_charge'], sort=False).ngroup().to_numpy()
+    above_precursor = (candidates['mz'] > candidates['precursor_mz']).to_numpy()
+    priority = candidates['ion_type'].map(ION_TYPE_PRIORITY).fillna(-1).to_numpy()
+    length = (candidates['end'] - candidates['start']).to_numpy()
+
+    # lexsort uses the last key as the primary sort key
+    order = np.lexsort((-length, -priority, ~above_precursor, group))
+    ranked = candidates.iloc[order]
+    rank = ranked.groupby(group[order], sort=False).cumcount().to_numpy()
+
+    keep = rank < policy.top_n
+    ranked = ranked[keep].assign(rank=rank[keep] + 1)
+    return ranked.assign(intensity=10000.0 * (policy.top_n - ranked['rank'] + 1) / policy.top_n)
+
+
+def format_transitions(ranked: pd.DataFrame) -> str:
+    """Format ranked transitions as TSV rows without a header"""
+    if ranked.empty:
+        return ''
+    transitions = pd.DataFrame({
+        'PrecursorMz': ranked['precursor_mz'].round(6),
+        'ProductMz': ranked['mz'].round(6),
+        'LibraryIntensity': ranked['intensity'].round(1),
+        'PeptideSequence': ranked['stripped'],
+        'ModifiedPeptideSequence': ranked['peptide'],
+        'PrecursorCharge': ranked['precursor_charge'],
+        'ProductCharge': ranked['charge'],
+        'FragmentType': ranked['ion_type'],
+        'FragmentSeriesNumber': ranked['end'] - ranked['start'],
+        'TransitionRank': ranked['rank'],
+    })
+    return transitions.to_csv(sep='\t', index=False, header=False)
+
+
+def format_msp(ranked: pd.DataFrame) -> str:
+    """Format ranked transitions as MSP library entries, one per precursor"""
+    if ranked.empty:
+        return ''
+
+    group = ranked.groupby(['peptide', 'precursor_charge'], sort=False).ngroup().to_numpy()
+    order = np.lexsort((ranked['mz'].to_numpy(), group))
+    peaks = ranked.iloc[order]
+    group = group[order]
+
+    # build every peak line at once, then split them by precursor
+    length = (peaks['end'] - peaks['start']).astype(str)
+    charge_suffix = np.where(peaks['charge'] > 1, '^' + peaks['charge'].astype(str), '')
+    peak_lines = (peaks['mz'].map('{:.6f}'.format) + '\t' + peaks['intensity'].map('{:.1f}'.format)
+                  + '\t"' + peaks['ion_type'] + length + charge_suffix + '"').tolist()
+
+    boundaries = np.flatnonzero(np.diff(group)) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(peaks)]))
+
+    entries = []
+    for start, stop in zip(starts, stops):
+        first = peaks.iloc[start]
+        # the modified sequence keeps differently modified forms of a peptide apart
+        entries.append(f'Name: {first["peptide"]}/{first["precursor_charge"]}\n'
+                       f'MW: {first["neutral_mass"]:.6f}\n'
+                       f'Comment: Parent={first["precursor_mz"]:.6f} Proforma={first["peptide"]}\n'
+                       f'Num peaks: {stop - start}\n'
+                       + '\n'.join(peak_lines[start:stop]) + '\n\n')
+    return ''.join(entries)
+
+
+def export_shard(shard_index: int, peptides: List[str], policy: ExportPolicy, part_dir: str,
+                 buffer_size: int = 1 << 20) -> Tuple[int, int, int]:
+    """
+    Export one shard of peptides to its own transition and MSP part files
+
+    Returns:
+        Tuple of shard index, number of precursors and number of transitions written
+    """
+    ranked = rank_transitions(fragment_precursors(peptides, policy), policy)
+
+    transitions_path = os.path.join(part_dir, f'transitions.part-{shard_index:06d}.tsv')
+    msp_path = os.path.join(part_dir, f'library.part-{shard_index:06d}.msp')
+    with open(transitions_path, 'w', buffering=buffer_size) as f:
+        f.write(format_transitions(ranked))
+    with open(msp_path, 'w', buffering=buffer_size) as f:
+        f.write(format_msp(ranked))
+
+    n_precursors = 0 if ranked.empty else int(ranked.groupby(['peptide', 'precursor_charge']).ngroups)
+    return shard_index, n_precursors, len(ranked)
+
+
+def read_peptides(path: str) -> Iterator[str]:
+    """Read one peptide per line, skipping blank lines"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def unique_peptides(peptides: Iterator[str]) -> Iterator[str]:
+    """Drop repeated peptides, keeping the first occurrence"""
+    seen = set()
+    for peptide in peptides:
+        if peptide not in seen:
+            seen.add(peptide)
+            yield peptide
+
+
+def _shards(peptides: Iterator[str], shard_size: int) -> Iterator[List[str]]:
+    shard = []
+    for peptide in peptides:
+        shard.append(peptide)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def export_library(peptides: Iterator[str], output_prefix: str, policy: ExportPolicy,
+                   shard_size: int = 1000, workers: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Export a transition list and MSP library for a stream of peptides
+
+    Args:
+        peptides: Iterator of ProForma peptide sequences, repeats are exported once
+        output_prefix: Output path prefix, writes <prefix>.tsv and <prefix>.msp
+        policy: Charge, ion type, m/z bounds and transition selection policy
+        shard_size: Number of peptides per shard
+        workers: Number of worker processes, defaults to the CPU count
+
+    Returns:
+        Tuple of number of precursors and number of transitions written
+    """
+    workers = workers or os.cpu_count() or 1
+    # at most two shards per worker are in flight, so memory stays bounded for any input size
+    max_in_flight = 2 * workers
+    n_precursors, n_transitions, n_shards = 0, 0, 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_prefix))) as part_dir:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            # a repeated peptide would be written as a second library entry, or merged into its own top-n
+            for shard in _shards(unique_peptides(peptides), shard_size):
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _, precursors, transitions = future.result()
+                        n_precursors += precursors
+                        n_transitions += transitions
+                pending.add(executor.submit(export_shard, n_shards, shard, policy, part_dir))
+                n_shards += 1
+
+            for future in pending:
+                _, precursors, transitions = future.result()
+                n_precursors += precursors
+                n_transitions += transitions
+
+        with open(f'{output_prefix}.tsv', 'w') as out:
+            out.write('\t'.join(TRANSITION_COLUMNS) + '\n')
+            for i in range(n_shards):
+                with open(os.path.join(part_dir, f'transitions.part-{i:06d}.tsv')) as part:
+                    shutil.copyfileobj(part, out)
+
+        with open(f'{output_prefix}.msp', 'w') as out:
+            for i in range(n_shards):
+                with open(os.path.join(part_dir, f'library.part-{i:06d}.msp')) as part:
+                    shutil.copyfileobj(part, out)
+
+    return n_precursors, n_transitions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Export transition lists and MSP libraries for a peptide list')
+    parser.add_argument('peptides', help='Text file with one ProForma peptide per line')
+    parser.add_argument('-o', '--output', default='library', help='Output prefix for the .tsv and .msp files')
+    parser.add_argument('--charges', type=int, nargs='+', default=[2, 3], help='Precursor charge states')
+    parser.add_argument('--ion-types', nargs='+', default=['b', 'y'], choices=list('abcxyz'), help='Ion types')
+    parser.add_argument('--max-fragment-charge', type=int, default=2, help='Highest fragment charge state')
+    parser.add_argument('--min-mz', type=float, default=None, help='Lowest product m/z')
+    parser.add_argument('--max-mz', type=float, default=None, help='Highest product m/z')
+    parser.add_argument('--min-length', type=int, default=3, help='Shortest fragment length')
+    parser.add_argument('--top-n', type=int, default=6, help='Transitions per precursor')
+    parser.add_argument('--average', action='store_true', help='Use average instead of monoisotopic masses')
+    parser.add_argument('--engine', default=FRAGMENT_ENGINE, choices=sorted(ENGINES), help='Fragment engine')
+    parser.add_argument('--shard-size', type=int, default=1000, help='Peptides per shard')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes')
+    args = parser.parse_args(argv)
+
+    policy = ExportPolicy(precursor_charges=args.charges,
+                          ion_types=args.ion_types,
+                          max_fragment_charge=args.max_fragment_charge,
+                          min_mz=args.min_mz,
+                          max_mz=args.max_mz,
+                          min_length=args.min_length,
+                          top_n=args.top_n,
+                          monoisotopic=not args.average,
+                          engine=args.engine)
+
+    n_precursors, n_transitions = export_library(read_peptides(args.peptides), args.output, policy,
+                                                 shard_size=args.shard_size, workers=args.workers)
+    print(f'Wrote {n_transitions} transitions for {n_precursors} precursors to {args.output}.tsv and {args.output}.msp')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Headless load-test harness for PepFrag.
+
+Replays a JSONL log of permalink query parameter sets against app.py using Streamlit's
+script-testing facility (AppTest). Each line of the log is a JSON object mapping query
+parameter names (peptide, charge, fragment_types, mass_type, min_mz, ...) to values,
+exactly as they appear in a shared PepFrag URL.
+
+Usage:
+    python load_test.py queries.jsonl --sessions 4 --repeat 2
+"""
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_APP_PATH = 'app.py'
+DEFAULT_TIMEOUT = 60.0
+
+
+def read_query_log(path: str) -> List[Dict[str, Any]]:
+    """Read a JSONL log of query parameter sets, skipping blank lines"""
+    queries = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            query = json.loads(line)
+            if not isinstance(query, dict):
+                raise ValueError(f'Line {line_number} of {path} is not a JSON object')
+            queries.append(query)
+    return queries
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_app_caches() -> None:
+    # AppTest runs every script under one fixed session id, so without this a repeated query would be
+    # served from the previous page load's cache instead of being rendered like a new visitor's
+    for module_name, cache_name in (('session_cache', 'SESSION_CACHE'), ('speculation', 'FRAGMENT_CACHE')):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            getattr(module, cache_name).clear()
+
+
+def _load_page(app_path: str, query: Dict[str, Any], timeout: float):
+    # Imported here so that each worker process initializes its own Streamlit runtime
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    for key, value in query.items():
+        at.query_params[key] = value if isinstance(value, list) else str(value)
+    return at
+
+
+def _run_session(app_path: str, queries: List[Dict[str, Any]], timeout: float, results: mp.Queue) -> None:
+    """Replay queries one after another, each as a fresh page load"""
+    # An untimed first load pays for the imports, which would otherwise land in the percentiles
+    try:
+        _load_page(app_path, queries[0], timeout).run()
+    except Exception:
+        pass
+
+    latencies, errors = [], 0
+    for query in queries:
+        _reset_app_caches()
+        at = _load_page(app_path, query, timeout)
+
+        start = time.perf_counter()
+        try:
+            at.run()
+        except Exception:  # timeouts and script runner failures count as errors
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+        if len(at.exception) > 0 or len(at.error) > 0:
+            errors += 1
+
+    results.put({'latencies': latencies, 'errors': errors, 'peak_rss_mb': _peak_rss_mb()})
+
+
+def run_load_test(queries: List[Dict[str, Any]],
+                  sessions: int = 1,
+                  repeat: int = 1,
+                  app_path: str = DEFAULT_APP_PATH,
+                  timeout: float = DEFAULT_TIMEOUT) -> Dict[str, float]:
+    """
+    Replay queries against the app with concurrent simulated sessions
+
+    Each worker first loads one page untimed, and the app's caches are cleared before every timed page load.
+
+    Args:
+        queries: List of query parameter dicts to replay
+        sessions: Number of concurrent simulated sessions (one worker process each)
+        repeat: Number of times to replay the full log
+        app_path: Path to the Streamlit script
+        timeout: Per-rerun timeout in seconds
+
+    Returns:
+        Dictionary of latency, throughput and memory statistics
+    """
+    # AppTest patches process-wide state while a script runs, so sessions are isolated in processes
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+
+    work = queries * repeat
+    shares = [work[i::sessions] for i in range(sessions)]
+    workers = [ctx.Process(target=_run_session, args=(app_path, share, timeout, results))
+               for share in shares if share]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    session_results = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([lat for res in session_results for lat in res['latencies']]) * 1000
+    peak_rss = [res['peak_rss_mb'] for res in session_results]
+
+    return {
+        'reruns': len(latencies),
+        'errors': sum(res['errors'] for res in session_results),
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else float('nan'),
+        'elapsed_s': elapsed,
+        # each worker is a separate interpreter, so their peaks are not added up
+        'peak_rss_per_process_mb': max(peak_rss, default=float('nan')),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Replay PepFrag permalink queries headlessly')
+    parser.add_argument('log', help='JSONL file with one query parameter set per line')
+    parser.add_argument('--sessions', type=int, default=1, help='Number of concurrent simulated sessions')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to replay the log')
+    parser.add_argument('--app', default=DEFAULT_APP_PATH, help='Path to the Streamlit app')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Per-rerun timeout (s)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if args.sessions < 1:
+        parser.error('--sessions must be at least 1')
+
+    report = run_load_test(queries=read_query_log(args.log),
+                           sessions=args.sessions,
+                           repeat=args.repeat,
+                           app_path=args.app,
+                           timeout=args.timeout)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Reruns:        {report['reruns']} ({report['errors']} errors)")
+    print(f"Latency p50:   {report['p50_ms']:.1f} ms")
+    print(f"Latency p95:   {report['p95_ms']:.1f} ms")
+    print(f"Latency p99:   {report['p99_ms']:.1f} ms")
+    print(f"Throughput:    {report['throughput_rps']:.2f} reruns/s over {report['elapsed_s']:.1f} s")
+    print(f"Peak RSS:      {report['peak_rss_per_process_mb']:.1f} MB (largest worker process)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Index of modification names, accessions and masses from the Unimod and PSI-MOD databases, used by the
+Modification Lookup in the sidebar.
+
+Built once per process at import. Lookups by name or accession are a single dict access returning a row
+into flat mass arrays, and prefix search (for autocomplete) is a binary search over the sorted lowercase
+names. The index is held in addition to peptacular's databases, which pt.parse and pt.mass still use to
+resolve mod names while fragmenting.
+
+Run `python mod_index.py` to print its memory footprint and lookup time.
+"""
+import bisect
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from peptacular.mods.mod_db_setup import UNIMOD_DB, PSI_MOD_DB
+
+import instrumentation
+
+# (database, accession prefix, accepted ProForma prefixes), Unimod first so it wins unprefixed names
+_DATABASES = [
+    (UNIMOD_DB, 'UNIMOD', ('unimod', 'u')),
+    (PSI_MOD_DB, 'MOD', ('mod', 'm')),
+]
+
+
+@dataclass
+class ModIndex:
+    names: List[str]
+    ids: List[str]
+    database_rows: np.ndarray
+    mono_masses: np.ndarray
+    avg_masses: np.ndarray
+    sorted_keys: List[str]
+    sorted_rows: np.ndarray
+    lookup: Dict[str, int]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def accession(self, row: int) -> str:
+        return f'{_DATABASES[self.database_rows[row]][1]}:{self.ids[row]}'
+
+    def find(self, name: str) -> Optional[int]:
+        """Row of a modification by name or accession (e.g. 'Acetyl', 'UNIMOD:1', 'U:Acetyl'), or None"""
+        return self.lookup.get(name.lower())
+
+    def mass(self, name: str, monoisotopic: bool = True) -> float:
+        """Mass of a modification by name or accession. NaN if the entry has no mass"""
+        row = self.find(name)
+        if row is None:
+            raise KeyError(f'Unknown modification: {name}')
+        return float(self.mono_masses[row] if monoisotopic else self.avg_masses[row])
+
+    def search(self, prefix: str, limit: int = 20) -> List[Tuple[str, str, float, float]]:
+        """Modifications whose name starts with prefix (case-insensitive), shortest names first"""
+        prefix = prefix.lower()
+        lo = bisect.bisect_left(self.sorted_keys, prefix)
+        hi = bisect.bisect_left(self.sorted_keys, prefix + '\uffff', lo)
+        rows = sorted(self.sorted_rows[lo:hi], key=lambda row: (len(self.names[row]), self.names[row]))[:limit]
+        return [(self.names[row], self.accession(row), float(self.mono_masses[row]), float(self.avg_masses[row]))
+                for row in rows]
+
+
+def _entry_mass(entry, monoisotopic: bool) -> float:
+    # same fallback as peptacular: use the composition only when the database has no mass
+    if monoisotopic:
+        m = entry.mono_mass if entry.mono_mass is not None else entry.calc_mono_mass
+    else:
+        m = entry.avg_mass if entry.avg_mass is not None else entry.calc_avg_mass
+    return float('nan') if m is None else m
+
+
+def build_mod_index() -> ModIndex:
+    """Build the index from peptacular's modification databases"""
+    names, ids, database_rows, mono_masses, avg_masses, name_keys = [], [], [], [], [], []
+    lookup: Dict[str, int] = {}
+
+    for database_row, (db, accession_prefix, proforma_prefixes) in enumerate(_DATABASES):
+        for entry in db:
+            row = len(names)
+            name_key = entry.name.lower()
+            names.append(entry.name)
+            ids.append(entry.id)
+            database_rows.append(database_row)
+            mono_masses.append(_entry_mass(entry, monoisotopic=True))
+            avg_masses.append(_entry_mass(entry, monoisotopic=False))
+            name_keys.append(name_key)
+
+            # keys are stored lowercase only; bare ids and names shared between databases go to Unimod
+            keys = [name_key, entry.id, f'{accession_prefix.lower()}:{entry.id}']
+            keys += [f'{p}:{value}' for p in proforma_prefixes for value in (name_key, entry.id)]
+            for key in keys:
+                lookup.setdefault(key, row)
+
+    order = sorted(range(len(names)), key=lambda row: name_keys[row])
+    return ModIndex(names=names,
+                    ids=ids,
+                    database_rows=np.array(database_rows, dtype=np.int8),
+                    mono_masses=np.array(mono_masses, dtype=np.float64),
+                    avg_masses=np.array(avg_masses, dtype=np.float64),
+                    sorted_keys=[name_keys[row] for row in order],
+                    sorted_rows=np.array(order, dtype=np.int32),
+                    lookup=lookup)
+
+
+# built at import, so the first search does not pay for it
+MOD_INDEX = build_mod_index()
+
+
+def get_mod_index() -> ModIndex:
+    """The process-wide modification index"""
+    return MOD_INDEX
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """Approximate the memory held by an object and everything it references"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+@lru_cache(maxsize=1)
+def footprint() -> Dict[str, int]:
+    """Number of entries and memory held by the index"""
+    return {
+        'entries': len(get_mod_index()),
+        'index_bytes': deep_sizeof(get_mod_index()),
+    }
+
+
+instrumentation.register('mod_index', footprint)
+
+
+if __name__ == '__main__':
+    import timeit
+    from peptacular.mods.mod_db import parse_unimod_mass
+
+    index = get_mod_index()
+    stats = footprint()
+    print(f"Entries:          {stats['entries']}")
+    print(f"Index footprint:  {stats['index_bytes'] / 1024:.0f} KiB")
+
+    n = 100_000
+    index_time = timeit.timeit(lambda: index.mass('Carbamidomethyl'), number=n) / n
+    peptacular_time = timeit.timeit(lambda: parse_unimod_mass('Carbamidomethyl', True), number=n) / n
+    print(f'Name to mass:     {index_time * 1e9:.0f} ns (index), {peptacular_time * 1e9:.0f} ns (peptacular)')
+    print(f"Prefix 'phos':    {[name for name, *_ in index.search('phos', limit=5)]}")
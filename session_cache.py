@@ -0,0 +1,184 @@
+"""
+Per-session cache of the large objects PepFrag builds (fragment DataFrames, Stylers and rendered HTML).
+
+Every artifact is accounted to the session that created it. When the total exceeds the global budget
+(PEPFRAG_MEMORY_BUDGET_MB, less the PEPFRAG_FRAGMENT_CACHE_SHARE held by the fragment cache), artifacts
+of the least recently used sessions are evicted, and are rebuilt by their factory the next time that
+session asks for them. Artifacts of sessions that have disconnected are dropped the next time any
+artifact is stored.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+from pandas.io.formats.style import Styler
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import instrumentation
+from constants import MEMORY_BUDGET_MB, FRAGMENT_CACHE_SHARE
+
+
+def estimate_size(obj: Any) -> int:
+    """Approximate the memory held by an artifact in bytes"""
+    if isinstance(obj, pd.DataFrame):
+        return frame_size(obj)
+    if isinstance(obj, Styler):
+        # the style callbacks are small; the data, one formatter per cell and any computed per cell CSS are not
+        return estimate_size(obj.data) + per_cell_size(obj._display_funcs) + per_cell_size(obj.ctx)
+    if isinstance(obj, (tuple, list)):
+        return sum(estimate_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+def frame_size(df: pd.DataFrame) -> int:
+    """
+    Approximate the memory held by a DataFrame, counting each Python object in object columns once
+
+    memory_usage(deep=True) counts an object again for every row that references it, which overstates
+    columns such as parent_sequence where every row shares one string.
+    """
+    size = int(df.memory_usage(index=True, deep=False).sum())
+    for column in df.columns[df.dtypes == object]:
+        objects = {id(value): value for value in df[column].to_numpy()}
+        size += sum(sys.getsizeof(value) for value in objects.values())
+    return size
+
+
+def per_cell_size(cells: Dict[Any, Any]) -> int:
+    """
+    Approximate the memory held by a Styler's per cell dict: formatters in _display_funcs, or lists of
+    (property, value) CSS pairs in ctx
+    """
+    size = sys.getsizeof(cells)
+    for cell, value in cells.items():
+        size += sys.getsizeof(cell) + sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(style) + sum(sys.getsizeof(part) for part in style) for style in value)
+    return size
+
+
+def current_session_id() -> str:
+    """Get the id of the Streamlit session running this thread"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else 'default'
+
+
+@dataclass
+class _Artifact:
+    key: Any
+    value: Any
+    size: int
+
+
+class SessionCache:
+    """LRU cache of per-session artifacts with a global memory budget"""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._sessions: 'OrderedDict[str, Dict[str, _Artifact]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = 0
+
+    def get(self, name: str, key: Any, factory: Callable[[], Any], session_id: Optional[str] = None) -> Any:
+        """
+        Get an artifact for the current session, building it if it is missing or stale
+
+        Args:
+            name: Name of the artifact, one value is kept per name and session
+            key: Inputs the artifact was built from, compared with == to detect stale values
+            factory: Builds the artifact
+            session_id: Session to account the artifact to, defaults to the current session
+
+        Returns:
+            The cached or newly built artifact
+        """
+        session_id = session_id or current_session_id()
+
+        with self._lock:
+            artifact = self._sessions.get(session_id, {}).get(name)
+            if artifact is not None and artifact.key == key:
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                return artifact.value
+            self.misses += 1
+
+        value = factory()
+        self.put(name, key, value, session_id)
+        return value
+
+    def put(self, name: str, key: Any, value: Any, session_id: Optional[str] = None) -> None:
+        """Store an artifact for a session and evict other sessions if over budget"""
+        session_id = session_id or current_session_id()
+        size = estimate_size(value)
+
+        with self._lock:
+            artifacts = self._sessions.setdefault(session_id, {})
+            previous = artifacts.get(name)
+            if previous is not None:
+                self._total_bytes -= previous.size
+            artifacts[name] = _Artifact(key=key, value=value, size=size)
+            self._total_bytes += size
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def discard(self, session_id: str) -> None:
+        """Drop every artifact of a session"""
+        with self._lock:
+            self._discard(session_id)
+
+    def clear(self) -> None:
+        """Drop every artifact of every session, keeping the statistics"""
+        with self._lock:
+            self._sessions.clear()
+            self._total_bytes = 0
+
+    def _discard(self, session_id: str) -> None:
+        artifacts = self._sessions.pop(session_id, {})
+        self._total_bytes -= sum(artifact.size for artifact in artifacts.values())
+
+    def _discard_closed_sessions(self) -> None:
+        # Streamlit has no session end callback, so sessions whose browser tab has gone are dropped here
+        if not runtime.exists():
+            return
+        instance = runtime.get_instance()
+        # the most recently used session is the one being served, so it is kept like in eviction
+        for session_id in [sid for sid in list(self._sessions)[:-1] if not instance.is_active_session(sid)]:
+            self._discard(session_id)
+            self.closed += 1
+
+    def _evict(self) -> None:
+        self._discard_closed_sessions()
+        # the most recently used session is never evicted, even if it alone is over budget
+        while self._total_bytes > self.budget_bytes and len(self._sessions) > 1:
+            _, artifacts = self._sessions.popitem(last=False)
+            self._total_bytes -= sum(artifact.size for artifact in artifacts.values())
+            self.evictions += len(artifacts)
+
+    def usage(self) -> Dict[str, Any]:
+        """Current memory usage and cache statistics"""
+        with self._lock:
+            largest = max((sum(a.size for a in artifacts.values()) for artifacts in self._sessions.values()),
+                          default=0)
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._total_bytes,
+                'budget_bytes': self.budget_bytes,
+                'largest_session_bytes': largest,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'closed_sessions': self.closed,
+            }
+
+
+# the rest of the budget goes to the fragment cache shared by all sessions (speculation.FRAGMENT_CACHE)
+SESSION_CACHE = SessionCache(budget_bytes=int(MEMORY_BUDGET_MB * (1 - FRAGMENT_CACHE_SHARE) * 1024 * 1024))
+instrumentation.register('session_memory', SESSION_CACHE.usage)
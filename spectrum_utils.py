@@ -0,0 +1,119 @@
+from typing import Dict, Optional, Tuple
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from constants import DEFAULT_SPECTRUM_BINS
+from utils import get_fragment_data
+
+
+def aggregate_peaks(frag_df: pd.DataFrame, mz_range: Tuple[float, float], n_bins: int) -> pd.DataFrame:
+    """
+    Aggregate fragment peaks within an m/z window into at most n_bins sticks per ion type
+
+    Args:
+        frag_df: DataFrame of fragments with 'mz', 'ion_type' and 'label' columns
+        mz_range: The (min, max) m/z window to plot
+        n_bins: Number of bins across the window, roughly one per screen pixel
+
+    Returns:
+        DataFrame with one row per stick: mz, ion_type, count and label
+    """
+    lo, hi = mz_range
+    peaks = frag_df.loc[(frag_df['mz'] >= lo) & (frag_df['mz'] <= hi), ['mz', 'ion_type', 'label']]
+
+    # Few enough peaks to send every stick
+    if len(peaks) <= n_bins:
+        return peaks.assign(count=1)
+
+    width = (hi - lo) / n_bins if hi > lo else 1.0
+    bins = np.minimum(((peaks['mz'].to_numpy() - lo) / width).astype(np.int64), n_bins - 1)
+
+    grouped = peaks.groupby([bins, peaks['ion_type']], sort=False)
+    sticks = grouped.agg(mz=('mz', 'mean'), label=('label', 'first'), count=('mz', 'size')).reset_index(level=1)
+
+    merged = sticks['count'] > 1
+    sticks.loc[merged, 'label'] = sticks.loc[merged, 'count'].astype(str) + ' peaks'
+    return sticks.reset_index(drop=True)[['mz', 'ion_type', 'label', 'count']]
+
+
+def create_spectrum_chart(peaks: pd.DataFrame,
+                          mz_range: Tuple[float, float],
+                          color_map: Dict[str, str],
+                          min_mass: Optional[float] = None,
+                          max_mass: Optional[float] = None) -> alt.LayerChart:
+    """
+    Create a stick spectrum chart of theoretical fragment m/z values
+
+    Args:
+        peaks: Aggregated peaks from aggregate_peaks
+        mz_range: The (min, max) m/z window to plot
+        color_map: Dictionary mapping ion types to colors
+        min_mass: Lower mass bound to shade
+        max_mass: Upper mass bound to shade
+
+    Returns:
+        Altair chart
+    """
+    ion_types = sorted(peaks['ion_type'].unique())
+    x_scale = alt.Scale(domain=list(mz_range), nice=False)
+
+    # theoretical peaks have no intensity, so every stick is drawn at full height
+    sticks = alt.Chart(peaks.assign(height=1.0)).mark_rule().encode(
+        x=alt.X('mz:Q', title='m/z', scale=x_scale),
+        y=alt.Y('height:Q', scale=alt.Scale(domain=[0, 1.05]), axis=None),
+        y2=alt.datum(0),
+        color=alt.Color('ion_type:N', title='Ion Type',
+                        scale=alt.Scale(domain=ion_types, range=[color_map.get(t, '#333') for t in ion_types])),
+        tooltip=[alt.Tooltip('label:N', title='Fragment'),
+                 alt.Tooltip('mz:Q', title='m/z', format='.4f'),
+                 alt.Tooltip('count:Q', title='Peaks')],
+    )
+
+    layers = []
+    if min_mass is not None and max_mass is not None:
+        lo, hi = max(min_mass, mz_range[0]), min(max_mass, mz_range[1])
+        if lo < hi:
+            bounds = pd.DataFrame({'lo': [lo], 'hi': [hi]})
+            layers.append(alt.Chart(bounds).mark_rect(color='#1f77b4', opacity=0.1).encode(
+                x=alt.X('lo:Q', scale=x_scale), x2='hi:Q'))
+
+    layers.append(sticks)
+
+    return alt.layer(*layers).properties(height=300)
+
+
+@st.fragment
+def display_spectrum(params, link_sites: Optional[Tuple[int, int]] = None) -> None:
+    """Display the theoretical spectrum. Zooming only reruns this fragment"""
+
+    frag_df = get_fragment_data(params, link_sites)
+
+    lo, hi = float(np.floor(frag_df['mz'].min())), float(np.ceil(frag_df['mz'].max()))
+    if lo == hi:
+        lo, hi = lo - 1.0, hi + 1.0
+
+    mz_range = st.slider('m/z Range',
+                         min_value=lo,
+                         max_value=hi,
+                         value=(lo, hi),
+                         help='Narrow the range to zoom in. Peaks are aggregated per pixel when zoomed out',
+                         key=f'spectrum_range_{lo}_{hi}')
+
+    peaks = aggregate_peaks(frag_df, mz_range, DEFAULT_SPECTRUM_BINS)
+
+    chart = create_spectrum_chart(peaks,
+                                  mz_range=mz_range,
+                                  color_map=params.frag_colors,
+                                  min_mass=params.min_mz if params.use_mass_bounds else None,
+                                  max_mass=params.max_mz if params.use_mass_bounds else None)
+
+    st.altair_chart(chart, use_container_width=True)
+
+    n_in_range = int(peaks['count'].sum())
+    if len(peaks) < n_in_range:
+        st.caption(f'{n_in_range} peaks aggregated into {len(peaks)} sticks. Zoom in for more detail.')
+    else:
+        st.caption(f'{n_in_range} peaks')
@@ -0,0 +1,330 @@
+"""
+Fragment cache with speculative precomputation of the next likely configuration.
+
+Fragments are cached per (sequence, ion type, charge, mass type, engine), so a table for several ion
+types is assembled from one piece per ion type and charge. After a result renders, the neighbouring
+configurations a user usually clicks next (one more fragment pill, charge +/- 1, the other mass type)
+are computed on a small background thread pool, so that click is usually a cache hit. Removing a
+pill needs no speculation, as its pieces are already cached.
+
+Speculation runs at the lowest OS scheduling priority where supported, and only while the pool stays
+within PEPFRAG_SPECULATION_CPU_BUDGET of one core. Work queued for an older render of the same
+session is dropped. Speculated pieces that are evicted before they are used are counted as waste.
+
+The cache holds PEPFRAG_FRAGMENT_CACHE_SHARE of PEPFRAG_MEMORY_BUDGET_MB, and the session cache the rest.
+Pieces keep no per-row sequence columns, which would otherwise make up most of their size.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import instrumentation
+from constants import (FRAGMENT_ENGINE, FRAGMENT_CACHE_SHARE, MEMORY_BUDGET_MB, SPECULATION, SPECULATION_WORKERS,
+                       SPECULATION_CPU_BUDGET)
+from fragment_engine import fragment, sample_shadow
+from session_cache import current_session_id, estimate_size
+
+logger = logging.getLogger(__name__)
+
+ION_TYPES = 'abcxyz'
+
+# queued tasks beyond this are skipped rather than left to pile up behind a slow peptide
+_MAX_PENDING = 32
+# the most CPU time the budget can save up while the pool is idle, in seconds
+_MAX_BURST = 1.0
+
+# per row copies of the sequence; the parent sequence is restored once per assembled result
+_PIECE_DROP_COLUMNS = ['sequence', 'unmod_sequence', 'parent_sequence']
+
+PieceKey = Tuple[str, str, int, bool, str]
+
+
+@dataclass
+class _Piece:
+    frag_df: pd.DataFrame
+    speculative: bool
+    size: int
+
+
+class FragmentCache:
+    """LRU cache of fragment DataFrames, one per sequence, ion type, charge, mass type and engine"""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._pieces: 'OrderedDict[PieceKey, _Piece]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.speculative_hits = 0
+        self.speculative_wasted = 0
+        self.too_large = 0
+
+    def get(self, key: PieceKey) -> Optional[pd.DataFrame]:
+        """Get a cached piece, or None"""
+        with self._lock:
+            piece = self._pieces.get(key)
+            if piece is None:
+                self.misses += 1
+                return None
+            self._pieces.move_to_end(key)
+            self.hits += 1
+            if piece.speculative:
+                self.speculative_hits += 1
+                piece.speculative = False
+            return piece.frag_df
+
+    def clear(self) -> None:
+        """Drop every cached piece, keeping the statistics"""
+        with self._lock:
+            self._pieces.clear()
+            self._total_bytes = 0
+
+    def __contains__(self, key: PieceKey) -> bool:
+        with self._lock:
+            return key in self._pieces
+
+    def put(self, key: PieceKey, frag_df: pd.DataFrame, speculative: bool = False) -> None:
+        """Store a piece and evict the least recently used pieces if over budget"""
+        size = estimate_size(frag_df)
+
+        with self._lock:
+            if key in self._pieces:
+                return
+            if size > self.budget_bytes:
+                self.too_large += 1
+                return
+            self._pieces[key] = _Piece(frag_df=frag_df, speculative=speculative, size=size)
+            self._total_bytes += size
+            while self._total_bytes > self.budget_bytes:
+                _, evicted = self._pieces.popitem(last=False)
+                self._total_bytes -= evicted.size
+                if evicted.speculative:
+                    self.speculative_wasted += 1
+
+    def usage(self) -> Dict[str, int]:
+        """Current cache statistics"""
+        with self._lock:
+            return {
+                'entries': len(self._pieces),
+                'bytes': self._total_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'too_large': self.too_large,
+                'speculative_hits': self.speculative_hits,
+                'speculative_wasted': self.speculative_wasted,
+                'speculative_unused': sum(piece.speculative for piece in self._pieces.values()),
+            }
+
+
+FRAGMENT_CACHE = FragmentCache(budget_bytes=int(MEMORY_BUDGET_MB * FRAGMENT_CACHE_SHARE * 1024 * 1024))
+
+
+def _piece_key(sequence: str, ion_type: str, charge: int, monoisotopic: bool, engine: str) -> PieceKey:
+    return sequence, ion_type, int(charge), bool(monoisotopic), engine
+
+
+def fragment_piece(sequence: str, ion_type: str, charge: int, monoisotopic: bool, engine: str) -> pd.DataFrame:
+    """Fragment one ion type at one charge, without the per-row sequence columns"""
+    frag_df = fragment(sequence, [ion_type], [charge], monoisotopic, engine=engine, verify=False)
+    return frag_df.drop(columns=[col for col in _PIECE_DROP_COLUMNS if col in frag_df.columns])
+
+
+def cached_fragment(sequence: str, ion_types: List[str], charges: List[int], monoisotopic: bool,
+                    engine: str = FRAGMENT_ENGINE) -> pd.DataFrame:
+    """
+    Fragment a sequence, reusing cached pieces for each ion type and charge
+
+    Args:
+        sequence: The peptide sequence
+        ion_types: List of ion types to generate (a, b, c, x, y, z)
+        charges: List of charge states
+        monoisotopic: Whether to use monoisotopic masses
+        engine: Name of the fragment engine to use
+
+    Returns:
+        DataFrame with one row per fragment, in the same order as fragment_engine.fragment
+    """
+    pieces = []
+    for ion_type in ion_types:
+        for charge in charges:
+            key = _piece_key(sequence, ion_type, charge, monoisotopic, engine)
+            frag_df = FRAGMENT_CACHE.get(key)
+            if frag_df is None:
+                frag_df = fragment_piece(sequence, ion_type, charge, monoisotopic, engine)
+                FRAGMENT_CACHE.put(key, frag_df)
+            pieces.append(frag_df)
+
+    pieces = [frag_df for frag_df in pieces if not frag_df.empty]
+    if not pieces:
+        return pd.DataFrame()
+    # concat copies, so callers can never modify a cached piece
+    result = pd.concat(pieces, ignore_index=True)
+    result.insert(result.columns.get_loc('loss') + 1, 'parent_sequence', sequence)
+
+    # sampled once per result, whether its pieces were cached, speculated or computed here
+    sample_shadow(result, sequence, ion_types, charges, monoisotopic, engine)
+    return result
+
+
+def neighbour_configurations(ion_types: List[str], charge: int,
+                             monoisotopic: bool) -> List[Tuple[List[str], int, bool]]:
+    """
+    Configurations one click away from the current one, most likely first
+
+    Removing a fragment pill is not included, as every piece it needs is already cached.
+    """
+    neighbours = [(list(ion_types) + [ion_type], charge, monoisotopic)
+                  for ion_type in ION_TYPES if ion_type not in ion_types]
+    neighbours += [(list(ion_types), c, monoisotopic) for c in (charge + 1, charge - 1) if c >= 0]
+    neighbours.append((list(ion_types), charge, not monoisotopic))
+    return neighbours
+
+
+def _lower_thread_priority() -> None:
+    # on Linux every thread has its own nice value; elsewhere speculation runs at normal priority
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+class Speculator:
+    """Background pool that fills FRAGMENT_CACHE with neighbouring configurations"""
+
+    def __init__(self, cache: FragmentCache, workers: int, cpu_budget: float):
+        self.cache = cache
+        self.workers = workers
+        self.cpu_budget = cpu_budget
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self._session_pending: Dict[str, int] = {}
+        self._pending = 0
+        self._tokens = _MAX_BURST
+        self._last_refill = time.monotonic()
+        self.stats = {'submitted': 0, 'computed': 0, 'stale': 0, 'over_budget': 0, 'queue_full': 0,
+                      'failed': 0, 'cpu_seconds': 0.0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # started on first use, so deployments with speculation off never create the threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pepfrag-speculate',
+                                                    initializer=_lower_thread_priority)
+            return self._executor
+
+    def speculate(self, sequences: List[str], ion_types: List[str], charge: int, monoisotopic: bool,
+                  engine: str = FRAGMENT_ENGINE, session_id: Optional[str] = None) -> None:
+        """
+        Queue the neighbouring configurations of a rendered result for precomputation
+
+        Args:
+            sequences: Sequences the result was fragmented from, one per chain
+            ion_types: Ion types of the rendered result
+            charge: Charge state of the rendered result
+            monoisotopic: Mass type of the rendered result
+            engine: Name of the fragment engine to use
+            session_id: Session that rendered the result, defaults to the current session
+        """
+        session_id = session_id or current_session_id()
+
+        with self._lock:
+            # work still queued for this session's previous render is dropped when it starts
+            generation = self._generations.get(session_id, 0) + 1
+            self._generations[session_id] = generation
+
+        for neighbour_ion_types, neighbour_charge, neighbour_monoisotopic in neighbour_configurations(
+                ion_types, charge, monoisotopic):
+            keys = [_piece_key(sequence, ion_type, neighbour_charge, neighbour_monoisotopic, engine)
+                    for sequence in sequences for ion_type in neighbour_ion_types]
+            keys = [key for key in keys if key not in self.cache]
+            if not keys:
+                continue
+
+            with self._lock:
+                if self._pending >= _MAX_PENDING:
+                    self.stats['queue_full'] += 1
+                    continue
+                self._pending += 1
+                self.stats['submitted'] += 1
+
+                self._session_pending[session_id] = self._session_pending.get(session_id, 0) + 1
+
+            self._get_executor().submit(self._compute, keys, session_id, generation)
+
+        with self._lock:
+            self._forget_idle_session(session_id)
+
+    def _forget_idle_session(self, session_id: str) -> None:
+        # a session with nothing queued has no stale work to drop, so its generation need not be kept
+        if not self._session_pending.get(session_id):
+            self._session_pending.pop(session_id, None)
+            self._generations.pop(session_id, None)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(_MAX_BURST, self._tokens + (now - self._last_refill) * self.cpu_budget)
+            self._last_refill = now
+            return self._tokens > 0
+
+    def _compute(self, keys: List[PieceKey], session_id: str, generation: int) -> None:
+        try:
+            for key in keys:
+                with self._lock:
+                    if self._generations.get(session_id) != generation:
+                        self.stats['stale'] += 1
+                        return
+                if not self._take_budget():
+                    with self._lock:
+                        self.stats['over_budget'] += 1
+                    return
+                if key in self.cache:
+                    continue
+
+                sequence, ion_type, charge, monoisotopic, engine = key
+                start = time.thread_time()
+                frag_df = fragment_piece(sequence, ion_type, charge, monoisotopic, engine)
+                spent = time.thread_time() - start
+
+                self.cache.put(key, frag_df, speculative=True)
+                with self._lock:
+                    self._tokens -= spent
+                    self.stats['computed'] += 1
+                    self.stats['cpu_seconds'] += spent
+        except Exception:
+            with self._lock:
+                self.stats['failed'] += 1
+            logger.exception('Speculative fragmentation failed for %r', keys)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._session_pending[session_id] -= 1
+                self._forget_idle_session(session_id)
+
+    def usage(self) -> Dict[str, Any]:
+        """Current speculation statistics, including the fragment cache"""
+        with self._lock:
+            stats = dict(self.stats, enabled=SPECULATION, workers=self.workers, cpu_budget=self.cpu_budget,
+                         pending=self._pending, sessions=len(self._generations))
+        stats['cache'] = self.cache.usage()
+        return stats
+
+
+SPECULATOR = Speculator(FRAGMENT_CACHE, workers=SPECULATION_WORKERS, cpu_budget=SPECULATION_CPU_BUDGET)
+instrumentation.register('speculation', SPECULATOR.usage)
+
+
+def speculate(sequences: List[str], ion_types: List[str], charge: int, monoisotopic: bool) -> None:
+    """Precompute the neighbouring configurations of a rendered result, if PEPFRAG_SPECULATION is on"""
+    if SPECULATION:
+        SPECULATOR.speculate(sequences, ion_types, charge, monoisotopic)
@@ -1,7 +1,17 @@
+import copy
+import math
+from dataclasses import asdict
+
 import streamlit as st
 import peptacular as pt
 import requests
 
+from crosslink_utils import is_crosslinked, split_chains, find_link_sites, style_crosslink_tables, \
+    crosslink_precursor_mass
+from fragment_utils import style_fragment_table
+from session_cache import SESSION_CACHE
+from speculation import speculate
+
 # app_utils.py
 from urllib.parse import quote_plus
 
@@ -59,7 +69,18 @@ def display_header():
     """, unsafe_allow_html=True)
 
 def validate_peptide(peptide_sequence: str) -> None:
-    """Parse and validate peptide sequence"""
+    """Parse and validate peptide sequence. Each chain of a cross-linked sequence is validated separately"""
+    if is_crosslinked(peptide_sequence):
+        try:
+            find_link_sites(peptide_sequence)
+        except (ValueError, pt.ProFormaFormatError) as e:
+            st.error(f'Error parsing cross-linked peptide sequence: {e}')
+            st.stop()
+
+        for chain in split_chains(peptide_sequence):
+            validate_peptide(chain)
+        return
+
     try:
         annotation = pt.parse(peptide_sequence)
     except pt.ProFormaFormatError as e:
@@ -89,11 +110,31 @@ def validate_peptide(peptide_sequence: str) -> None:
         st.stop()
 
 
-def create_caption_vertical(params):
+def precursor_mz(neutral_mass: float, charge: int) -> float:
+    """M/z of a precursor from its neutral mass, or the neutral mass itself at charge 0"""
+    return (neutral_mass + charge * pt.PROTON_MASS) / charge if charge else neutral_mass
+
+
+def create_caption(params, sequence_text: str, sequence_neutral_mass: float) -> str:
+    """
+    Caption box for the results, laid out as chosen in params
+
+    Args:
+        params: The app parameters
+        sequence_text: Sequence shown as the title, HTML
+        sequence_neutral_mass: Neutral mass of the precursor
+
+    Returns:
+        HTML of the caption box
+    """
+    if params.is_horizontal_caption:
+        return create_caption_horizontal(params, sequence_text, sequence_neutral_mass)
+    return create_caption_vertical(params, sequence_text, sequence_neutral_mass)
+
+
+def create_caption_vertical(params, sequence_text: str, sequence_neutral_mass: float) -> str:
 
-    # Calculate sequence mz with and without labile mods
-    sequence_mz = pt.mz(params.peptide_sequence, monoisotopic=params.is_monoisotopic, ion_type='p', charge=params.charge)
-    sequence_neutral_mass = pt.mass(params.peptide_sequence, monoisotopic=params.is_monoisotopic, ion_type='p', charge=0)  
+    sequence_mz = precursor_mz(sequence_neutral_mass, params.charge)
 
     mz_min, mz_max = params.min_mz, params.max_mz
     
@@ -114,7 +155,7 @@ def create_caption_vertical(params):
     caption = f"""
     <div style='text-align: center; padding: 20px; margin: 5px 0; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9;'>
         <div style='font-size: 1.2em; font-weight: bold; margin-bottom: 5px; color: #333;'>
-            {params.peptide_sequence}   
+            {sequence_text}
         </div>
         <div style='display: grid; grid-template-columns: 1fr 1fr; gap: 2px; margin-top: 5px; font-size: 0.95em;'>
             <div style='font-weight: bold; color: #333;'>
@@ -148,12 +189,9 @@ def create_caption_vertical(params):
     return caption
 
 
-def create_caption_horizontal(params):
+def create_caption_horizontal(params, sequence_text: str, sequence_neutral_mass: float) -> str:
 
-
-    # Calculate sequence mz with and without labile mods
-    sequence_mz = pt.mz(params.peptide_sequence, monoisotopic=params.is_monoisotopic, ion_type='p', charge=params.charge)
-    sequence_neutral_mass = pt.mass(params.peptide_sequence, monoisotopic=params.is_monoisotopic, ion_type='p', charge=0)  
+    sequence_mz = precursor_mz(sequence_neutral_mass, params.charge)
 
     mz_min, mz_max = params.min_mz, params.max_mz
     
@@ -174,7 +212,7 @@ def create_caption_horizontal(params):
     caption = f"""
     <div style='text-align: center; padding: 20px; margin: 5px 0; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9;'>
         <div style='font-size: 1.2em; font-weight: bold; margin-bottom: 5px; color: #333;'>
-            {params.peptide_sequence}   
+            {sequence_text}
         </div>
         <div style='display: grid; grid-template-columns: 1fr 1fr 1fr 1fr{" 1fr" if use_mass_bounds else ""}; gap: 2px; margin-top: 5px; font-size: 0.95em;'>
             <div style='font-weight: bold; color: #333;'>
@@ -254,17 +292,159 @@ def shorten_url(url: str) -> str:
         return f"Error: {e}"
     
 
-def display_results(style_df, params):
-    """Display the results of fragment calculation"""
+def get_fragment_table(params):
+    """Get the styled fragment table and fragment data, reusing the session's cached copy"""
+
+    def build():
+        sequence = pt.parse(params.peptide_sequence).serialize(include_plus=True)
+        return style_fragment_table(
+            sequence=sequence,
+            fragment_types=params.fragment_types,
+            charge=params.charge,
+            is_monoisotopic=params.is_monoisotopic,
+            show_borders=params.show_borders,
+            decimal_places=params.precision,
+            row_padding=params.row_padding,
+            column_padding=params.column_padding,
+            min_mass=params.min_mz if params.use_mass_bounds else None,
+            max_mass=params.max_mz if params.use_mass_bounds else None,
+            color_map=params.frag_colors,
+            caption=create_caption(params, params.peptide_sequence,
+                                   pt.mass(sequence, monoisotopic=params.is_monoisotopic, ion_type='p', charge=0)),
+        )
+
+    return SESSION_CACHE.get('fragment_table', asdict(params), build)
+
+
+def get_crosslink_tables(params, link_sites):
+    """Get the two styled ladders and fragment data of a cross-linked peptide, reusing the session's cached copy"""
+
+    def build():
+        alpha, beta = split_chains(params.peptide_sequence)
+        return style_crosslink_tables(
+            alpha=alpha,
+            beta=beta,
+            alpha_site=link_sites[0],
+            beta_site=link_sites[1],
+            fragment_types=params.fragment_types,
+            charge=params.charge,
+            is_monoisotopic=params.is_monoisotopic,
+            show_borders=params.show_borders,
+            decimal_places=params.precision,
+            row_padding=params.row_padding,
+            column_padding=params.column_padding,
+            min_mass=params.min_mz if params.use_mass_bounds else None,
+            max_mass=params.max_mz if params.use_mass_bounds else None,
+            color_map=params.frag_colors,
+        )
+
+    return SESSION_CACHE.get('crosslink_tables', (asdict(params), link_sites), build)
+
+
+def get_fragment_data(params, link_sites=None):
+    """Get the fragment data of a linear or (when link_sites are given) cross-linked peptide"""
+    if link_sites is not None:
+        return get_crosslink_tables(params, link_sites)[1]
+    return get_fragment_table(params)[1]
+
+
+def speculate_next(params, link_sites=None):
+    """Precompute the configurations a user is likely to pick next, once the current result has rendered"""
+    if link_sites is not None:
+        sequences = split_chains(params.peptide_sequence)
+    else:
+        # the same serialization get_fragment_table fragments, so the cache keys match
+        sequences = [pt.parse(params.peptide_sequence).serialize(include_plus=True)]
+
+    speculate(sequences, params.fragment_types, params.charge, params.is_monoisotopic)
+
+
+def display_crosslink_results(params, link_sites):
+    """Display the two linked fragment ladders of a cross-linked peptide side by side"""
+
+    style_dfs, _ = get_crosslink_tables(params, link_sites)
+
+    alpha, beta = split_chains(params.peptide_sequence)
+    neutral_mass = crosslink_precursor_mass(alpha, beta, params.is_monoisotopic)
+    st.markdown(create_caption(params, f'{alpha}<br>{beta}', neutral_mass), unsafe_allow_html=True)
+
+    for chain, (col, style_df) in enumerate(zip(st.columns(2), style_dfs)):
+        with col:
+            display_results(style_df, params, link_sites, chain)
+
+
+def get_styled_table(params, link_sites=None, chain=0):
+    """Get the styled table of a linear peptide, or of one chain of a cross-linked peptide"""
+    if link_sites is None:
+        return get_fragment_table(params)[0]
+    return get_crosslink_tables(params, link_sites)[0][chain]
+
 
+def display_results(style_df, params, link_sites=None, chain=0):
+    """Display the results of fragment calculation, paginating long tables"""
+
+    n_rows = len(style_df.data)
+    if n_rows <= params.rows_per_page:
+        display_table_rows(params, link_sites=link_sites, chain=chain)
+        return
+
+    display_table_page(params, link_sites, chain)
+
+
+@st.fragment
+def display_table_page(params, link_sites=None, chain=0):
+    """Display one page of residues. Changing the page only reruns this fragment"""
+
+    # only params are held by the fragment, so an evicted table is rebuilt rather than kept alive
+    style_df = get_styled_table(params, link_sites, chain)
+    n_rows = len(style_df.data)
+    n_pages = math.ceil(n_rows / params.rows_per_page)
+
+    page = st.number_input(f'Page (of {n_pages})',
+                           min_value=1,
+                           max_value=n_pages,
+                           value=1,
+                           help='Long tables are sent to the browser one page at a time',
+                           key=f'table_page_{chain}_{n_pages}')
+
+    start = (page - 1) * params.rows_per_page
+    stop = min(start + params.rows_per_page, n_rows)
+    st.caption(f'Showing residues {start + 1}-{stop} of {n_rows}')
+
+    display_table_rows(params, start, stop, link_sites, chain)
+
+
+def display_table_rows(params, start=None, stop=None, link_sites=None, chain=0):
+    """Display the rows [start, stop) of the styled fragment table"""
+
+    html = SESSION_CACHE.get(f'table_html_{chain}', (asdict(params), link_sites, start, stop),
+                             lambda: render_table_html(get_styled_table(params, link_sites, chain), params.charge,
+                                                       start, stop))
+
+    st.markdown(html,
+        unsafe_allow_html=True
+    )
+
+
+def render_table_html(style_df, charge, start=None, stop=None):
+    """Render the rows [start, stop) of the styled fragment table as HTML"""
+
+    if start is not None or stop is not None:
+        index = style_df.data.index
+        hidden = index[:start or 0].append(index[stop:] if stop is not None else index[:0])
+        # copy so the hidden rows do not leak into the shared Styler
+        style_df = copy.copy(style_df).hide(hidden, axis='index')
 
     # Display the fragment table
     html = style_df.to_html()
 
     # Update the column headers to include the superscript charge state
     for col in ["A", "B", "C", "X", "Y", "Z"]:
-        html = html.replace(f'{col}</th>', f'{col}<sup>{params.charge}+</sup></th>')
+        html = html.replace(f'{col}</th>', f'{col}<sup>{charge}+</sup></th>')
 
-    st.markdown(html,
-        unsafe_allow_html=True
-    )
\ No newline at end of file
+    return html
+
+
+def fragment_table_to_tsv(style_df, decimal_places):
+    """Convert the fragment table to tab-separated text for copying"""
+    return style_df.data.to_csv(sep='\t', index=False, float_format=f'%.{decimal_places}f')